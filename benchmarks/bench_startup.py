@@ -0,0 +1,87 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+""" Benchmark of the startup of the command line, i.e., the time from launching the interpreter until a command has
+imported what it needs and can start working: the checker for verify, and the transformation with a ready C parser
+for transform. The heavy dependencies (pycparser, z3, sympy and asyncio) are only imported by the commands that need
+them, and z3 / sympy only once the transformation needs them (see benchmarks/bench_transform.py for that part).
+The run fails if the startup of any command is slower than the target.
+
+    python benchmarks/bench_startup.py [--target 0.25] [--repeat 10]
+"""
+from collections import OrderedDict
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+import coloredlogs
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# the code run in a fresh interpreter to start each command
+COMMANDS = OrderedDict((
+    ('python', 'pass'),
+    ('verify', 'from shadowdp.__main__ import main; import asyncio'),
+    ('transform', 'from shadowdp.__main__ import main; from shadowdp.transform import transform; '
+                  'from shadowdp.typesystem import get_parser; get_parser()')
+))
+
+
+def measure(code, repeat):
+    """ return the best wall time in seconds of running the code in a fresh interpreter."""
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+        seconds = min(seconds, time.perf_counter() - start)
+    return seconds
+
+
+def main(argv=sys.argv[1:]):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('-r', '--repeat', action='store', dest='repeat', type=int, default=10,
+                            help='The number of runs of each command, the best time is taken.', required=False)
+    arg_parser.add_argument('-t', '--target', action='store', dest='target', type=float, default=0.25,
+                            help='The maximum startup time of each command in seconds, default is 0.25.',
+                            required=False)
+    results = arg_parser.parse_args(argv)
+
+    coloredlogs.install(level='INFO', fmt='%(levelname)s:%(module)s: %(message)s')
+
+    slow = []
+    for command, code in COMMANDS.items():
+        seconds = measure(code, results.repeat)
+        logger.info('{}: {:.3f} seconds'.format(command, seconds))
+        if seconds > results.target:
+            slow.append(command)
+    if len(slow) != 0:
+        logger.error('Startup of {} is slower than the target {:g} seconds'.format(', '.join(slow), results.target))
+        return 1
+    logger.info('Startup of all commands is within the target {:g} seconds'.format(results.target))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
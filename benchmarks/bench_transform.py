@@ -0,0 +1,224 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+""" Micro-benchmark of the transformer (ShadowDPTransformer.visit only, no checker needed) on synthetic programs
+(see shadowdp.generator) that grow in one dimension at a time: number of variables, statements, branch depth, loop
+nesting, Lap samples and query accesses.
+The results are compared against a baseline (benchmarks/baseline.json) and the run fails if the time of any program
+relative to the smallest program of its dimension grows faster than in the baseline by more than the threshold. Unlike
+the seconds, which depend on the speed of the machine, these growth ratios can be compared across machines. The
+baseline also records the machine and the interpreter it was taken on, and a warning is printed when they differ
+from the current ones, since the ratios still vary somewhat with both: record your own baseline (--update) then. On a
+noisy (e.g., shared virtual) machine, raise --repeat or --threshold.
+
+    python benchmarks/bench_transform.py [--update] [--threshold 0.25] [--output results.json]
+"""
+from collections import OrderedDict
+import argparse
+import copy
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import coloredlogs
+from sympy.core.cache import clear_cache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shadowdp.core import ShadowDPTransformer  # noqa: E402
+from shadowdp.transform import FUNCTION_MAP  # noqa: E402
+from shadowdp.generator import generate  # noqa: E402
+from shadowdp.typesystem import clear_caches, get_parser  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# the size of each dimension when the others grow
+DEFAULTS = OrderedDict((('variables', 2), ('statements', 2), ('depth', 1), ('loops', 1), ('samples', 1),
+                        ('queries', 1)))
+# the sizes of each dimension to measure
+SIZES = OrderedDict((
+    ('variables', (1, 2, 4, 8, 16)),
+    ('statements', (1, 2, 4, 8, 16)),
+    ('depth', (1, 2, 3, 4, 5)),
+    ('loops', (1, 2, 3, 4)),
+    ('samples', (1, 2, 4, 8, 16)),
+    ('queries', (1, 2, 4, 8, 16))
+))
+
+
+def _machine():
+    """ the machine and interpreter the timings are taken on, runs on different ones are not comparable."""
+    return OrderedDict((('platform', platform.platform()), ('architecture', platform.machine()),
+                        ('cpus', os.cpu_count()),
+                        ('python', '{} {}'.format(platform.python_implementation(), platform.python_version()))))
+
+
+def _clear_caches():
+    # measure the cold transformation, as in a single run of shadowdp, instead of the one with the simplifications
+    # memoized by the previous runs
+    clear_caches()
+    clear_cache()
+
+
+def _time(ast, program):
+    """ return the seconds of transforming a copy of the parsed program."""
+    copied = copy.deepcopy(ast)
+    _clear_caches()
+    # as timeit does, keep the garbage collector from adding noise to the time
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        ShadowDPTransformer(function_map=FUNCTION_MAP, set_epsilon=program.epsilon,
+                            set_goal=program.goal).visit(copied)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def _peak_memory(ast, program):
+    """ return the peak bytes of transforming a copy of the parsed program, measured apart from the time since tracing
+    slows down the transformation."""
+    copied = copy.deepcopy(ast)
+    _clear_caches()
+    tracemalloc.start()
+    ShadowDPTransformer(function_map=FUNCTION_MAP, set_epsilon=program.epsilon, set_goal=program.goal).visit(copied)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run(repeat):
+    """ measure the programs growing in each dimension, the time of each program is the best of repeat runs, taken in
+    repeat rounds over all programs rather than back to back, so that a slow period of the machine does not spoil all
+    the runs of the same program.
+    :return: dimension -> list of {size, seconds, peak_bytes}.
+    """
+    programs = OrderedDict()
+    for dimension, sizes in SIZES.items():
+        for size in sizes:
+            program = generate(**OrderedDict(DEFAULTS, **{dimension: size}))
+            programs[(dimension, size)] = (program, get_parser().parse(program.source))
+    # warm up the imports
+    warm_up = generate(**DEFAULTS)
+    _time(get_parser().parse(warm_up.source), warm_up)
+    seconds = {point: float('inf') for point in programs}
+    for _ in range(repeat):
+        for point, (program, ast) in programs.items():
+            seconds[point] = min(seconds[point], _time(ast, program))
+
+    results = OrderedDict()
+    for (dimension, size), (program, ast) in programs.items():
+        peak = _peak_memory(ast, program)
+        logger.info('{} = {}: {:.4f} seconds, {:.1f} KiB'.format(dimension, size, seconds[(dimension, size)],
+                                                                 peak / 1024))
+        results.setdefault(dimension, []).append(
+            OrderedDict((('size', size), ('seconds', seconds[(dimension, size)]), ('peak_bytes', peak))))
+    for dimension, points in results.items():
+        first, last = points[0], points[-1]
+        logger.info('{} grows {}x: time grows {:.2f}x, memory grows {:.2f}x'
+                    .format(dimension, last['size'] // first['size'], last['seconds'] / first['seconds'],
+                            last['peak_bytes'] / first['peak_bytes']))
+    return results
+
+
+def _growth(points):
+    """ return size -> the time of the program relative to the first (smallest) program of the dimension."""
+    return OrderedDict((point['size'], point['seconds'] / points[0]['seconds']) for point in points)
+
+
+def compare(results, baseline, threshold):
+    """ return the list of (dimension, size, growth, baseline growth) where the time relative to the smallest program
+    of the dimension (see _growth) grows faster than in the baseline by more than threshold."""
+    regressions = []
+    for dimension, points in results.items():
+        expected = baseline.get(dimension, ())
+        # the growth ratios are only comparable relative to the same smallest program
+        if len(expected) == 0 or expected[0]['size'] != points[0]['size']:
+            continue
+        expected = _growth(expected)
+        for size, growth in _growth(points).items():
+            if size in expected and growth > expected[size] * (1 + threshold):
+                regressions.append((dimension, size, growth, expected[size]))
+    return regressions
+
+
+def main(argv=sys.argv[1:]):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('-r', '--repeat', action='store', dest='repeat', type=int, default=5,
+                            help='The number of runs of each program, the best time is taken.', required=False)
+    arg_parser.add_argument('-t', '--threshold', action='store', dest='threshold', type=float, default=0.25,
+                            help='The allowed growth of the times relative to the baseline, default is 0.25 (25%%).',
+                            required=False)
+    arg_parser.add_argument('-b', '--baseline', action='store', dest='baseline', type=str, default=BASELINE,
+                            help='The baseline file.', required=False)
+    arg_parser.add_argument('-o', '--output', action='store', dest='output', type=str, default=None,
+                            help='Write the results to the file.', required=False)
+    arg_parser.add_argument('--update', action='store_true', dest='update', default=False,
+                            help='Store the results as the new baseline.', required=False)
+    results = arg_parser.parse_args(argv)
+
+    coloredlogs.install(level='INFO', fmt='%(levelname)s:%(module)s: %(message)s')
+    # the transformer logs every statement
+    logging.getLogger('shadowdp').setLevel(logging.WARNING)
+
+    measurements = run(results.repeat)
+    recorded = OrderedDict(machine=_machine())
+    recorded.update(measurements)
+    if results.output:
+        with open(results.output, 'w') as f:
+            json.dump(recorded, f, indent=2)
+    if results.update:
+        with open(results.baseline, 'w') as f:
+            json.dump(recorded, f, indent=2)
+        logger.info('Baseline updated at {}'.format(results.baseline))
+        return 0
+    if not os.path.exists(results.baseline):
+        logger.warning('No baseline found at {}, run with --update to create one'.format(results.baseline))
+        return 0
+
+    with open(results.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('machine') != recorded['machine']:
+        logger.warning('*' * 80)
+        logger.warning('The baseline was recorded on another machine or interpreter: {}'
+                       .format(dict(baseline.get('machine', {}))))
+        logger.warning('This run is on {}'.format(dict(recorded['machine'])))
+        logger.warning('The growth ratios vary somewhat with both, run with --update to record your own baseline')
+        logger.warning('*' * 80)
+    regressions = compare(measurements, baseline, results.threshold)
+    for dimension, size, growth, expected in regressions:
+        first = measurements[dimension][0]['size']
+        logger.error('{} = {}: {:.2f}x the time of {} = {}, grows faster than in the baseline ({:.2f}x) by {:.0%}'
+                     .format(dimension, size, growth, dimension, first, expected, growth / expected - 1))
+    if len(regressions) != 0:
+        return 1
+    logger.info('No regressions found (threshold {:.0%})'.format(results.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,8 +20,6 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #!/bin/bash
-passed=()
-errored=()
 
 # handles ctrl-c
 trap ctrl_c INT
@@ -30,39 +28,5 @@ function ctrl_c() {
     exit 1
 }
 
-check()
-{
-    shadowdp check $1;
-    if [[ $? == 0 ]]; then
-        passed+=("$1")
-    else
-        errored+=("$1")
-    fi
-    echo ''
-}
-
-check "examples/original/noisymax.c"
-check "examples/original/sparsevector.c"
-# apply setting epsilon technique to solve non-linearity
-check "examples/original/sparsevectorN.c -e NN"
-check "examples/original/gapsparsevector.c -e NN"
-check "examples/original/numsparsevector.c -e 1"
-check "examples/original/numsparsevectorN.c -e NN"
-check "examples/original/partialsum.c -e 1"
-check "examples/original/prefixsum.c -e 1"
-check "examples/original/smartsum.c -e 1 -g 2"
-
-return_val=0
-echo -e "Report: \e[32m ${#passed[@]} files passed. \e[0m\e[31m${#errored[@]} files failed.\e[0m"
-
-if [[ ${#errored[@]} != 0 ]]; then
-    return_val=1
-    echo -e "\e[31mFailed commands:"
-    for error in "${errored[@]}"
-    do
-        echo ${error}
-    done
-    echo -e "\e[0m"
-fi
-
-exit ${return_val}
+# transform and verify all case-studied algorithms in parallel, extra arguments (e.g., -j 4) are passed to shadowdp
+shadowdp batch -m examples/original/manifest.txt "$@"
@@ -19,6 +19,28 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from shadowdp.checker import check
-from shadowdp.typesystem import TypeSystem
-from shadowdp.core import ShadowDPTransformer
+import sys
+
+# the public names are imported on first access (PEP 562) so that `python -m shadowdp verify` doesn't pay for
+# importing pycparser and z3, the older pythons import them eagerly
+_EXPORTS = {
+    'check': 'shadowdp.checker',
+    'TypeSystem': 'shadowdp.typesystem',
+    'ShadowDPTransformer': 'shadowdp.core',
+    'parse_source': 'shadowdp.transform',
+    'parse_path': 'shadowdp.transform',
+    'transform_ast': 'shadowdp.transform',
+    'transform_source': 'shadowdp.transform',
+}
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _EXPORTS:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+        import importlib
+        return getattr(importlib.import_module(_EXPORTS[name]), name)
+else:
+    from shadowdp.checker import check
+    from shadowdp.typesystem import TypeSystem
+    from shadowdp.core import ShadowDPTransformer
+    from shadowdp.transform import parse_source, parse_path, transform_ast, transform_source
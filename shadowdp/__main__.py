@@ -21,48 +21,32 @@
 # SOFTWARE.
 import argparse
 import coloredlogs
+import json
 import os.path
 import sys
-import time
 import logging
-from pycparser import parse_file
-from pycparser.c_generator import CGenerator
-from shadowdp.core import ShadowDPTransformer
-from shadowdp.exceptions import *
-from shadowdp.checker import check
+from shadowdp.checker import check, parse_portfolio, RETENTION_POLICIES
+from shadowdp.batch import Task, parse_manifest, run_batch
+from shadowdp import profiler
 
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(level='INFO', fmt='%(levelname)s:%(module)s: %(message)s')
 
-__HEADER = r"""extern void __VERIFIER_error() __attribute__ ((__noreturn__));
-extern int __VERIFIER_nondet_float(void);
-extern int __VERIFIER_nondet_int();
-extern void __VERIFIER_assume(int);
-extern void __assert_fail();
-#define __VERIFIER_assert(cond) { if(!(cond)) { __assert_fail(); } }
-#define Abs(x) ((x) < 0 ? -(x) : (x))
-typedef enum { false = 0, true = 1 } bool;
-    
-"""
-
-__FUNCTION_MAP = {
-    'assert': '__VERIFIER_assert',
-    'assume': '__VERIFIER_assume',
-    'havoc': '__VERIFIER_nondet_float'
-}
-
 
 def main(argv=sys.argv[1:]):
     arg_parser = argparse.ArgumentParser(description=__doc__)
     arg_parser.add_argument('option', metavar='OPTION', type=str, nargs=1,
                             help='check - transform and verify.\n'
                                  'transform - only transform the source code.\n'
-                                 'verify - only verify the transformed code.')
-    arg_parser.add_argument('file', metavar='FILE', type=str, nargs=1)
+                                 'verify - only verify the transformed code.\n'
+                                 'batch - transform and verify multiple files in parallel.')
+    arg_parser.add_argument('file', metavar='FILE', type=str, nargs='*',
+                            help='The source file, - to read it from stdin (for check and transform).')
     arg_parser.add_argument('-o', '--out',
                             action='store', dest='out', type=str,
-                            help='The output file name.', required=False)
+                            help='The output file name, - to write it to stdout (for transform), default is '
+                                 'FILE_t.c, or stdout if FILE is -.', required=False)
     arg_parser.add_argument('-c', '--checker',
                             action='store', dest='checker', type=str, default='./cpachecker',
                             help='The checker path.', required=False)
@@ -77,17 +61,103 @@ def main(argv=sys.argv[1:]):
                             help='The goal of the algorithm, default is epsilon-differential privacy, specify'
                                  'this value to set different goal. '
                                  'e.g., specify 2 to check for 2 * epsilon-differential privacy', required=False)
+    arg_parser.add_argument('-m', '--manifest',
+                            action='store', dest='manifest', type=str, default=None,
+                            help='The manifest file for batch option, each line being '
+                                 'FILE [-e EPSILON] [-g GOAL] [-a ARGUMENTS].', required=False)
+    arg_parser.add_argument('-j', '--jobs',
+                            action='store', dest='jobs', type=int, default=None,
+                            help='The number of worker processes for batch option, default is the number of '
+                                 'cores / the number of concurrent solvers. For the other options, the number of '
+                                 'worker processes to transform the functions of a multi-function file in, default '
+                                 'is the number of cores.',
+                            required=False)
+    arg_parser.add_argument('-s', '--solvers',
+                            action='store', dest='solvers', type=str, default=None,
+                            help='Comma-separated solvers to run, default is MathSat,Z3,SMTInterpol.', required=False)
+    arg_parser.add_argument('-t', '--timeout',
+                            action='store', dest='timeout', type=str, default=None,
+                            help='The time limit of each solver in seconds, a number for all solvers and / or '
+                                 'NAME=SECONDS for specific solvers, e.g., 60,Z3=120, default is 30.', required=False)
+    arg_parser.add_argument('--max-solvers',
+                            action='store', dest='max_solvers', type=int, default=None,
+                            help='The maximum number of solvers running at the same time, default is all. '
+                                 'Solvers are launched in the order of their past performance, the others start '
+                                 'only when a running one fails.', required=False)
+    arg_parser.add_argument('-w', '--workspace',
+                            action='store', dest='workspace', type=str, default=None,
+                            help='The directory to create the workspace of each check in, which holds the solver '
+                                 'outputs, e.g., /dev/shm for a tmpfs, default is the current directory.',
+                            required=False)
+    arg_parser.add_argument('--keep',
+                            action='store', dest='keep', type=str, default='winner', choices=RETENTION_POLICIES,
+                            help='The solver outputs to keep in the workspace, default is the reports of the solver '
+                                 'which verifies the program.', required=False)
+    arg_parser.add_argument('--profile',
+                            action='store', dest='profile', type=str, default=None,
+                            help='Write a JSON report of the time and peak memory of each phase (parsing, '
+                                 'transformation rules, sympy, z3, code emission and each solver) to PROFILE, '
+                                 'with the number of expressions simplified natively and by sympy, and the '
+                                 'iterations and time of the fixed point of each loop.',
+                            required=False)
+    arg_parser.add_argument('--decompose',
+                            action='store_true', dest='decompose', default=False,
+                            help='Verify each assertion of the transformed program as its own job (with the other '
+                                 'assertions turned into assumes) in parallel, stop as soon as one fails, and report '
+                                 'the verdict and time of each assertion.', required=False)
+    arg_parser.add_argument('-O', '--optimize',
+                            action='store_true', dest='optimize', default=False,
+                            help='Optimize the transformed program for the verifier, i.e., fold the constants, '
+                                 'hoist and remove the redundant assumes and remove the dead distance variables.',
+                            required=False)
+    arg_parser.add_argument('--no-cache',
+                            action='store_true', dest='no_cache', default=False,
+                            help='Don\'t use the on-disk caches, i.e., always run the parser, z3 and the checker '
+                                 'instead of using the cached parsed sources, query results and verdicts, and don\'t '
+                                 'use the JVM class data archive or the history of the solvers.', required=False)
     results = arg_parser.parse_args(argv)
-    results.file = results.file[0]
-    results.out = results.file[0:results.file.rfind('.')] + '_t.c' if results.out is None else results.out
 
-    if results.option[0] not in ('check', 'transform', 'verify'):
-        logger.error('Option should be check / transform / verify')
+    if results.option[0] not in ('check', 'transform', 'verify', 'batch'):
+        logger.error('Option should be check / transform / verify / batch')
         return 1
 
-    if not os.path.exists(results.file):
-        logger.error('File {} doesn\'t exists'.format(results.file))
+    try:
+        portfolio = parse_portfolio(results.solvers, results.timeout, results.max_solvers)
+    except ValueError as e:
+        logger.error(e)
+        return 1
+
+    if results.option[0] == 'batch':
+        tasks = [Task(file, results.epsilon, results.goal, results.arguments) for file in results.file]
+        if results.manifest:
+            if not os.path.exists(results.manifest):
+                logger.error('Manifest {} doesn\'t exists'.format(results.manifest))
+                return 1
+            tasks.extend(parse_manifest(results.manifest))
+        if len(tasks) == 0:
+            logger.error('No files to check, specify FILE or --manifest')
+            return 1
+    elif len(results.file) != 1:
+        logger.error('Option {} takes exactly one FILE'.format(results.option[0]))
         return 1
+    else:
+        results.file = results.file[0]
+        if results.file == '-':
+            results.out = '-' if results.out is None else results.out
+        else:
+            results.out = results.file[0:results.file.rfind('.')] + '_t.c' if results.out is None else results.out
+        if results.option[0] == 'verify' and results.file == '-':
+            logger.error('Option verify takes a FILE, not stdin')
+            return 1
+        if results.option[0] == 'check' and results.out == '-':
+            logger.error('Option check needs the transformed code in a file, specify it with --out')
+            return 1
+        tasks = [Task(results.file, results.epsilon, results.goal, results.arguments)]
+
+    for task in tasks:
+        if task.file != '-' and not os.path.exists(task.file):
+            logger.error('File {} doesn\'t exists'.format(task.file))
+            return 1
 
     if results.option[0] != 'transform':
         if not os.path.isdir(results.checker):
@@ -100,45 +170,36 @@ def main(argv=sys.argv[1:]):
             logger.error('Please run scripts/get_cpachecker.sh to get a precompiled version of cpachecker')
             return 1
 
-    if results.option[0] == 'check' or results.option[0] == 'transform':
-        # parse the source code
-        logger.info('Parsing {}'.format(results.file))
-        start = time.time()
-        ast = parse_file(results.file, use_cpp=True, cpp_path='gcc', cpp_args=['-E'])
-        transformer = ShadowDPTransformer(function_map=__FUNCTION_MAP,
-                                          set_epsilon=results.epsilon, set_goal=results.goal)
-
-        try:
-            transformer.visit(ast)
-        except NoParameterAnnotationError as e:
-            logger.error('{} First statements must be a string containing annotation'.format(str(e.coord)))
-            return 1
-        except NoSamplingAnnotationError as e:
-            logger.error('{} Sampling command lack annotation'.format(str(e.coord)))
-            return 1
-        except ReturnDistanceNotZero as e:
-            logger.error('{}: Aligned distance of return variable {} is not zero ({})'
-                         .format(str(e.coord), e.name, e.distance))
-            return 1
-        except SamplingCommandMisplaceError as e:
-            logger.error('{}: Cannot use sampling command in diverging branch.'.format(e.coord))
-            return 1
-        except SamplingCommandInjectivityError as e:
-            logger.error('{}: Distance annotation {} for {} isn\'t injective'.format(e.coord, e.eta, e.annotation))
-        else:
-            # write the transformed code
-            with open(results.out, 'w') as f:
-                # write verifier headers
-                f.write(__HEADER)
-                f.write(CGenerator().visit(ast))
+    if results.workspace is not None and not os.path.isdir(results.workspace):
+        logger.error('Workspace {} doesn\'t exist'.format(results.workspace))
+        return 1
+
+    if results.option[0] == 'batch':
+        batch_results = run_batch(results.checker, tasks, results.jobs, not results.no_cache, portfolio,
+                                  results.workspace, results.keep, results.profile, results.optimize,
+                                  results.decompose)
+        return 0 if all(is_verified for _, is_verified, _ in batch_results) else 1
 
-            logger.info('Transformation finished in {0:.3f} seconds'.format(time.time() - start))
+    if results.profile:
+        profiler.start()
 
-    is_verified = False
-    if results.option[0] == 'check':
-        is_verified = check(results.checker, results.out, results.arguments)
+    is_verified = True
+    if results.option[0] == 'check' or results.option[0] == 'transform':
+        # imported only when needed since importing pycparser takes most of the startup time of verify
+        from shadowdp.transform import transform
+        is_verified = transform(results.file, results.out, results.epsilon, results.goal, results.jobs,
+                                not results.no_cache, results.optimize)
+
+    if results.option[0] == 'check' and is_verified:
+        is_verified = check(results.checker, results.out, results.arguments, not results.no_cache, portfolio,
+                            results.workspace, results.keep, results.decompose)
     elif results.option[0] == 'verify':
-        is_verified = check(results.checker, results.file, results.arguments)
+        is_verified = check(results.checker, results.file, results.arguments, not results.no_cache, portfolio,
+                            results.workspace, results.keep, results.decompose)
+
+    if results.profile:
+        with open(results.profile, 'w') as f:
+            json.dump(dict(file=results.file, **profiler.stop()), f, indent=2)
 
     # shell code 0 means SUCCESS
     return 0 if is_verified else 1
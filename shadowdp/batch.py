@@ -0,0 +1,129 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import shlex
+import time
+import logging
+from shadowdp.checker import check, parse_portfolio
+from shadowdp import profiler
+logger = logging.getLogger(__name__)
+
+
+Task = namedtuple('Task', ('file', 'epsilon', 'goal', 'arguments'))
+
+
+def _task_to_command(task):
+    command = task.file
+    for flag, value in (('-e', task.epsilon), ('-g', task.goal), ('-a', task.arguments)):
+        if value is not None:
+            command += ' {} {}'.format(flag, shlex.quote(value))
+    return command
+
+
+def parse_manifest(path):
+    """ parse a manifest file, each non-empty line is a task with the same format as the command line, i.e.,
+    FILE [-e EPSILON] [-g GOAL] [-a ARGUMENTS], lines starting with # are ignored.
+    :param path: The path of the manifest file.
+    :return: list of Task.
+    """
+    entry_parser = argparse.ArgumentParser(prog=path, add_help=False)
+    entry_parser.add_argument('file', type=str)
+    entry_parser.add_argument('-e', '--epsilon', dest='epsilon', type=str, default=None)
+    entry_parser.add_argument('-g', '--goal', dest='goal', type=str, default=None)
+    entry_parser.add_argument('-a', '--arguments', dest='arguments', type=str, default=None)
+
+    tasks = []
+    with open(path) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            entry = entry_parser.parse_args(shlex.split(line))
+            # relative paths in manifest are relative to the manifest itself
+            file = os.path.join(os.path.dirname(path), entry.file) if not os.path.isabs(entry.file) else entry.file
+            tasks.append(Task(os.path.normpath(file), entry.epsilon, entry.goal, entry.arguments))
+    return tasks
+
+
+def _run_task(checker, task, use_cache, portfolio, workspace, keep, profile, optimize, decompose):
+    from shadowdp.transform import transform
+    if profile:
+        profiler.start()
+    start = time.time()
+    out = task.file[0:task.file.rfind('.')] + '_t.c'
+    try:
+        # the tasks already run in parallel, so the functions of a task are transformed in this worker, and its
+        # functions or assertions are verified one at a time, each with up to portfolio.max_concurrency solvers
+        is_verified = transform(task.file, out, task.epsilon, task.goal, jobs=1, use_cache=use_cache,
+                                optimize=optimize) and \
+            check(checker, out, task.arguments, use_cache, portfolio, workspace, keep, decompose, jobs=1)
+    except Exception as e:
+        # a single broken program shouldn't bring down the whole batch
+        logger.error('{}: {}: {}'.format(task.file, type(e).__name__, e))
+        is_verified = False
+    return is_verified, time.time() - start, profiler.stop()
+
+
+def run_batch(checker, tasks, jobs=None, use_cache=True, portfolio=None, workspace=None, keep='winner',
+              profile=None, optimize=False, decompose=False):
+    """ transform and verify the tasks in a pool of worker processes, and report the results when all finish.
+    :param checker: The checker path.
+    :param tasks: list of Task.
+    :param jobs: The number of worker processes, default is cpu count / the number of concurrent solvers of each
+    check.
+    :param use_cache: Whether to use the on-disk caches.
+    :param portfolio: The Portfolio of solvers for each check.
+    :param workspace: The directory to create the workspaces of the checks in.
+    :param keep: The retention policy of the solver outputs in the workspaces.
+    :param profile: The path to write the profile reports (a JSON list, one for each task) to, None to not profile.
+    :param optimize: Whether to optimize the transformed programs for the verifier.
+    :param decompose: Whether to verify each assertion of the transformed programs as its own job.
+    :return: list of (Task, is_verified, seconds), in the same order as tasks.
+    """
+    portfolio = portfolio if portfolio else parse_portfolio()
+    jobs = jobs if jobs else max(1, (os.cpu_count() or 1) // portfolio.max_concurrency)
+    logger.info('Start checking {} programs with {} workers...'.format(len(tasks), jobs))
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_run_task, checker, task, use_cache, portfolio, workspace, keep, profile is not None,
+                                   optimize, decompose) for task in tasks]
+        outcomes = [future.result() for future in futures]
+    results = [(task, is_verified, seconds) for task, (is_verified, seconds, _) in zip(tasks, outcomes)]
+    if profile:
+        with open(profile, 'w') as f:
+            json.dump([dict(file=task.file, **report) for task, (_, _, report) in zip(tasks, outcomes)], f, indent=2)
+
+    passed = [task for task, is_verified, _ in results if is_verified]
+    failed = [task for task, is_verified, _ in results if not is_verified]
+    for task, is_verified, seconds in results:
+        logger.info('{} {} in {:.3f} seconds'.format(task.file, 'passed' if is_verified else 'failed', seconds))
+    logger.info('Report: {} files passed, {} files failed, finished in {:.3f} seconds.'
+                .format(len(passed), len(failed), time.time() - start))
+    if len(failed) != 0:
+        logger.warning('Failed commands:')
+        for task in failed:
+            logger.warning(_task_to_command(task))
+    return results
@@ -0,0 +1,128 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import fcntl
+import hashlib
+import os
+import pickle
+import tempfile
+import logging
+logger = logging.getLogger(__name__)
+
+# the lock file of DiskCache.update in each namespace, never evicted so that all processes lock the same file
+_LOCK = '.lock'
+
+
+def cache_root():
+    """ return the root directory for all caches, which is $SHADOWDP_CACHE_DIR if set,
+    otherwise $XDG_CACHE_HOME/shadowdp (default ~/.cache/shadowdp)."""
+    if os.environ.get('SHADOWDP_CACHE_DIR'):
+        return os.environ['SHADOWDP_CACHE_DIR']
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                        'shadowdp')
+
+
+class DiskCache:
+    """ A size-bounded key-value store on disk which can be shared between processes. Each entry is a pickled file
+    named after its key, written atomically. When the total size exceeds max_size, least recently used entries
+    (by modification time, which is refreshed on hits) are evicted."""
+    def __init__(self, namespace, max_size=64 * 1024 * 1024, root=None):
+        self._path = os.path.join(root if root else cache_root(), namespace)
+        self._max_size = max_size
+
+    @staticmethod
+    def key(*parts):
+        """ compute the content-addressed key from the given parts (str or bytes)."""
+        digest = hashlib.sha256()
+        for part in parts:
+            part = part if isinstance(part, bytes) else str(part).encode('utf-8')
+            # prefix with the length so that the boundaries of parts are unambiguous
+            digest.update(str(len(part)).encode('ascii') + b':' + part)
+        return digest.hexdigest()
+
+    def get(self, key, default=None):
+        path = os.path.join(self._path, key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            # mark as recently used
+            os.utime(path)
+            return value
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+
+    def set(self, key, value):
+        try:
+            os.makedirs(self._path, exist_ok=True)
+            # write to a temporary file first and then rename, so readers never see a partially written entry
+            fd, temp_path = tempfile.mkstemp(dir=self._path, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, os.path.join(self._path, key))
+            self._evict()
+        except OSError as e:
+            # cache is only an optimization, never fail because of it
+            logger.debug('Cannot write cache entry {} to {}: {}'.format(key, self._path, e))
+
+    def update(self, key, function, default=None):
+        """ replace the entry with function(the current value, or default if there is none), the updates are
+        serialized between processes by a lock file so that concurrent updates of the same entry aren't lost."""
+        try:
+            os.makedirs(self._path, exist_ok=True)
+            with open(os.path.join(self._path, _LOCK), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self.set(key, function(self.get(key, default)))
+        except OSError as e:
+            logger.debug('Cannot update cache entry {} in {}: {}'.format(key, self._path, e))
+
+    def clear(self):
+        if not os.path.isdir(self._path):
+            return
+        for entry in os.scandir(self._path):
+            if entry.name == _LOCK:
+                continue
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self._path):
+            if entry.name == _LOCK:
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                # might be evicted by other processes
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        if total_size <= self._max_size:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+            if total_size <= self._max_size:
+                break
@@ -19,105 +19,628 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from collections import OrderedDict
-from queue import Queue
+from collections import OrderedDict, namedtuple
 import os
+import signal
 import subprocess
-import threading
 import logging
 import shutil
 import re
+import tempfile
+import time
+from shadowdp.cache import DiskCache, cache_root
+from shadowdp import profiler
 logger = logging.getLogger(__name__)
 
+# solver name -> (cpachecker configuration, options, whether extra arguments are passed)
+SOLVERS = OrderedDict((
+    ('MathSat', ('-predicateAnalysis',
+                 ('-setprop', 'cpa.predicate.encodeFloatAs=RATIONAL',
+                  '-setprop', 'cpa.predicate.encodeBitvectorAs=INTEGER',
+                  '-setprop', 'solver.nonLinearArithmetic=USE',
+                  '-setprop', 'solver.solver=MATHSAT5'),
+                 True)),
+    ('Z3', ('-predicateAnalysis',
+            ('-setprop', 'cpa.predicate.encodeFloatAs=RATIONAL',
+             '-setprop', 'cpa.predicate.encodeBitvectorAs=INTEGER',
+             '-setprop', 'solver.nonLinearArithmetic=USE',
+             '-setprop', 'solver.solver=Z3'),
+            True)),
+    ('SMTInterpol', ('-predicateAnalysis-linear',
+                     ('-setprop', 'solver.solver=smtinterpol'),
+                     False))
+))
 
-def _thread_wait_for(results, name, process):
-    try:
-        # wait for 30 seconds
-        out, err = process.communicate(timeout=30)
-        if r'Verification result: TRUE' in str(out):
-            results.put((True, name, None, None))
+
+# the time limit of each solver in seconds if not specified
+DEFAULT_TIMEOUT = 30
+
+# solvers: names of the solvers in SOLVERS to run, timeouts: solver name -> seconds,
+# max_concurrency: the maximum number of solvers running at the same time (None for all)
+Portfolio = namedtuple('Portfolio', ('solvers', 'timeouts', 'max_concurrency'))
+
+# which solver outputs to keep in the workspace of a check: the reports of the verifying solver, all, or nothing
+RETENTION_POLICIES = ('winner', 'all', 'none')
+
+# the function definitions in the code emitted by pycparser's CGenerator, i.e., the declarator starts a line and the
+# body starts on the next one, the prototypes and macros in the verifier headers don't match
+_FUNCTION_DEFINITION = re.compile(r'^[A-Za-z_][\w \t*]*?\b([A-Za-z_]\w*)\s*\([^;{}]*\)\s*\{', re.MULTILINE)
+
+# the assertions in the transformed program, the macro definition in the verifier headers doesn't match
+_ASSERTION = re.compile(r'(?<!#define )\b__VERIFIER_assert(?=\s*\()')
+
+# an assertion of the transformed program, verified on its own with --decompose: the function it is in, its line,
+# its condition and the offset of the assertion in the program
+Obligation = namedtuple('Obligation', ('function', 'line', 'condition', 'offset'))
+
+
+def parse_portfolio(solvers=None, timeout=None, max_concurrency=None):
+    """ build the solver portfolio from the command line options.
+    :param solvers: Comma-separated solver names, default is all solvers in SOLVERS.
+    :param timeout: Comma-separated time limits in seconds, either a number for all solvers or NAME=SECONDS for a
+    specific solver, e.g., "60,Z3=120", default is DEFAULT_TIMEOUT.
+    :param max_concurrency: The maximum number of solvers running at the same time, default is all.
+    :return: Portfolio.
+    """
+    names = tuple(name.strip() for name in solvers.split(',') if len(name.strip()) != 0) if solvers \
+        else tuple(SOLVERS.keys())
+    for name in names:
+        if name not in SOLVERS:
+            raise ValueError('Unknown solver {}, should be one of {}'.format(name, ', '.join(SOLVERS.keys())))
+    if len(names) == 0 or len(set(names)) != len(names):
+        raise ValueError('Solvers should be a non-empty list without duplicates, got {}'.format(solvers))
+
+    default, timeouts = DEFAULT_TIMEOUT, {}
+    for limit in (timeout.split(',') if timeout else ()):
+        name, _, seconds = limit.rpartition('=')
+        if name and name.strip() not in names:
+            raise ValueError('Timeout is given for {} which is not in the portfolio'.format(name.strip()))
+        if float(seconds) <= 0:
+            raise ValueError('Timeout should be positive, got {}'.format(limit))
+        if name:
+            timeouts[name.strip()] = float(seconds)
         else:
-            results.put((False, name, out, err))
-    except subprocess.TimeoutExpired:
-        results.put((False, '30 seconds Timeout', '', ''))
+            default = float(seconds)
 
+    if max_concurrency is not None and max_concurrency <= 0:
+        raise ValueError('The number of concurrent solvers should be positive, got {}'.format(max_concurrency))
+    return Portfolio(names, {name: timeouts.get(name, default) for name in names},
+                     min(max_concurrency, len(names)) if max_concurrency else len(names))
 
-def check(checkerpath, path, args=None):
-    funcname = os.path.splitext(os.path.basename(path))[0]
-    args = args.split(' ') if args else ''
 
-    logger.info('Start checking {} with multiple solvers(MathSat, Z3, SMT-Interpol)...'.format(path))
-    processes = OrderedDict()
-    processes['MathSat'] = subprocess.Popen(
-        [checkerpath + '/scripts/cpa.sh', '-predicateAnalysis', path, '-preprocess',
-         '-setprop', 'cpa.predicate.encodeFloatAs=RATIONAL', '-setprop', 'cpa.predicate.encodeBitvectorAs=INTEGER',
-         '-setprop', 'solver.nonLinearArithmetic=USE', '-setprop', 'output.path=output-{}-MathSat'.format(funcname),
-         '-setprop', 'solver.solver=MATHSAT5',
-         *args],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    processes['Z3'] = subprocess.Popen(
-        [checkerpath + '/scripts/cpa.sh', '-predicateAnalysis', path, '-preprocess',
-         '-setprop', 'cpa.predicate.encodeFloatAs=RATIONAL', '-setprop', 'cpa.predicate.encodeBitvectorAs=INTEGER',
-         '-setprop', 'solver.nonLinearArithmetic=USE', '-setprop', 'output.path=output-{}-Z3'.format(funcname),
-         '-setprop', 'solver.solver=Z3',
-         *args],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    processes['SMTInterpol'] = subprocess.Popen(
-        [checkerpath + '/scripts/cpa.sh', '-predicateAnalysis-linear', path, '-preprocess',
-         '-setprop', 'solver.solver=smtinterpol', '-setprop', 'output.path=output-{}-SMTInterpol'.format(funcname)],
+def _entry_functions(source):
+    """ return the names of the functions defined in the transformed program, in order.
+    >>> source = 'extern void __VERIFIER_assume(int);\\nint f(float a)\\n{\\n  return 0;\\n}\\n\\nvoid g()\\n{\\n}\\n'
+    >>> _entry_functions(source)
+    ['f', 'g']
+    """
+    return _FUNCTION_DEFINITION.findall(source)
+
+
+def _obligations(source):
+    """ return the assertions in the transformed program as Obligations, in order.
+    >>> source = '#define __VERIFIER_assert(c) {}\\nint f(int a)\\n{\\n  __VERIFIER_assert((a > 0) && (a < 2));\\n}\\n'
+    >>> _obligations(source)
+    [Obligation(function='f', line=4, condition='(a > 0) && (a < 2)', offset=49)]
+    """
+    definitions = [(match.start(), match.group(1)) for match in _FUNCTION_DEFINITION.finditer(source)]
+    obligations = []
+    for match in _ASSERTION.finditer(source):
+        start = source.index('(', match.end()) + 1
+        end, depth = start, 1
+        while depth != 0 and end < len(source):
+            depth += {'(': 1, ')': -1}.get(source[end], 0)
+            end += 1
+        function = None
+        for offset, name in definitions:
+            if offset < match.start():
+                function = name
+        obligations.append(Obligation(function, source.count('\n', 0, match.start()) + 1,
+                                      ' '.join(source[start:end - 1].split()), match.start()))
+    return obligations
+
+
+def _decompose(source, obligations, index):
+    """ return the program to verify the index-th obligation, where the other assertions are turned into assumes.
+    >>> source = 'int f(int a)\\n{\\n  __VERIFIER_assert(a > 0);\\n  __VERIFIER_assert(a < 2);\\n}\\n'
+    >>> print(_decompose(source, _obligations(source), 1))
+    int f(int a)
+    {
+      __VERIFIER_assume(a > 0);
+      __VERIFIER_assert(a < 2);
+    }
+    <BLANKLINE>
+    """
+    pieces, last = [], 0
+    for other, obligation in enumerate(obligations):
+        if other != index:
+            pieces.extend((source[last:obligation.offset], '__VERIFIER_assume'))
+            last = obligation.offset + len('__VERIFIER_assert')
+    pieces.append(source[last:])
+    return ''.join(pieces)
+
+
+def _kill(process):
+    """ kill cpa.sh together with the JVM it started, which holds the output pipes."""
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # already exited
+        pass
+
+
+async def _wait_for_verdict(process, on_verdict):
+    """ stream the output of the solver line by line, and call on_verdict as soon as it reports the verdict, so
+    that the other solvers can be stopped while this one writes its reports and exits.
+    :return: (outcome, stdout, stderr) where outcome is one of verified / false / error.
+    """
+    import asyncio
+    # drain stderr at the same time, otherwise the solver blocks when the pipe is full
+    err = asyncio.ensure_future(process.stderr.read())
+    try:
+        outcome, out = 'error', []
+        line = await process.stdout.readline()
+        while line:
+            out.append(line)
+            if outcome == 'error' and b'Verification result: TRUE' in line:
+                outcome = 'verified'
+                on_verdict()
+            elif outcome == 'error' and b'Verification result: FALSE' in line:
+                outcome = 'false'
+                on_verdict()
+            line = await process.stdout.readline()
+        await process.wait()
+        return outcome, b''.join(out), await err
+    finally:
+        err.cancel()
+
+
+async def _sample_peak_rss(process, peak):
+    """ keep the peak resident memory of the solver in peak[0] until cancelled."""
+    import asyncio
+    while process.returncode is None:
+        peak[0] = max(peak[0], profiler.peak_rss(process.pid))
+        await asyncio.sleep(0.1)
+
+
+async def _run_solver(checkerpath, path, output, name, args, entry, env, timeout, on_verdict):
+    """ run a solver until it exits or the time limit expires, the solver is killed if cancelled.
+    :param entry: The options of cpachecker to select the entry function, passed to all solvers.
+    :return: (outcome, stdout, stderr) where outcome is one of verified / false / error / timeout.
+    """
+    import asyncio
+    configuration, options, use_arguments = SOLVERS[name]
+    start = time.time()
+    process = await asyncio.create_subprocess_exec(
+        checkerpath + '/scripts/cpa.sh', configuration, path, '-preprocess', *options, *entry,
+        '-setprop', 'output.path={}'.format(output), *(args if use_arguments else ()),
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
+        stderr=subprocess.PIPE,
+        env=env,
+        # in its own process group so that it can be killed as a whole
+        start_new_session=True
     )
+    peak, outcome = [0], 'cancelled'
+    sampler = asyncio.ensure_future(_sample_peak_rss(process, peak)) if profiler.is_enabled() else None
+    try:
+        outcome, out, err = await asyncio.wait_for(_wait_for_verdict(process, on_verdict), timeout)
+        return outcome, out, err
+    except asyncio.TimeoutError:
+        outcome = 'timeout'
+        return outcome, b'', '{:g} seconds timeout'.format(timeout).encode('ascii')
+    finally:
+        if sampler:
+            sampler.cancel()
+            peak[0] = max(peak[0], profiler.peak_rss(process.pid))
+        _kill(process)
+        await process.wait()
+        profiler.record_solver(name, outcome, time.time() - start, peak[0])
+
+
+def _history_keys(source, function):
+    """ return the keys of the history of the program (by its contents and entry function, so that the programs
+    with the same name don't share their history) and of all programs."""
+    return DiskCache.key('program', source, function if function else ''), DiskCache.key('solvers')
+
+
+def _order_solvers(solvers, program_history, solver_history):
+    """ order the solvers by their (smoothed) rates of verifying the program and then by their average time to
+    verify it, using the history of this program if there is any, otherwise the history of all programs. Solvers
+    without history keep the order in the portfolio.
+    >>> _order_solvers(('MathSat', 'Z3'), {}, {})
+    ['MathSat', 'Z3']
+    >>> _order_solvers(('MathSat', 'Z3'), {}, {'MathSat': {'error': 2}, 'Z3': {'verified': 2, 'seconds': 3.0}})
+    ['Z3', 'MathSat']
+    >>> history = {'MathSat': {'verified': 1, 'seconds': 5.0}, 'Z3': {'verified': 1, 'seconds': 9.0}}
+    >>> _order_solvers(('Z3', 'MathSat'), history, {'Z3': {'verified': 5, 'seconds': 5.0}})
+    ['MathSat', 'Z3']
+    """
+    history = program_history if any(name in program_history for name in solvers) else solver_history
+
+    def score(name):
+        record = history.get(name, {})
+        runs = sum(record.get(outcome, 0) for outcome in ('verified', 'false', 'error', 'timeout'))
+        wins = record.get('verified', 0)
+        return -(wins + 1) / (runs + 2), record.get('seconds', 0) / wins if wins else float('inf')
+
+    return sorted(solvers, key=score)
+
+
+def _record_history(history, outcomes):
+    """ add the outcomes (solver name -> (outcome, seconds)) of a run to the history."""
+    history = {name: dict(record) for name, record in history.items()}
+    for name, (outcome, seconds) in outcomes.items():
+        record = history.setdefault(name, {})
+        record[outcome] = record.get(outcome, 0) + 1
+        if outcome == 'verified':
+            record['seconds'] = record.get('seconds', 0) + seconds
+    return history
+
+
+def _checker_revision(checkerpath):
+    """ identify the checker build by the location, size and modification time of its jar (or its script if
+    the jar cannot be found), which is much cheaper than asking cpachecker for its version."""
+    for filename in ('cpachecker.jar', os.path.join('scripts', 'cpa.sh')):
+        path = os.path.join(checkerpath, filename)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            return '{}:{}:{}'.format(os.path.realpath(path), stat.st_size, stat.st_mtime)
+    return os.path.realpath(checkerpath)
 
-    # start threads to wait for results
-    results = Queue()
-    threads = set()
-    for name, proc in processes.items():
-        thread = threading.Thread(target=_thread_wait_for, args=(results, name, proc))
-        threads.add(thread)
-        thread.start()
+
+def _class_data_archive(checkerpath):
+    """ return the path of the class data sharing archive for the checker and the java it runs on."""
+    java = os.environ.get('JAVA') or shutil.which('java') or 'java'
+    java = os.path.realpath(java)
+    java_identity = '{}:{}'.format(java, os.stat(java).st_mtime) if os.path.exists(java) else java
+    return os.path.join(cache_root(), 'jvm',
+                        'cpachecker-{}.jsa'.format(DiskCache.key(_checker_revision(checkerpath), java_identity)[:16]))
+
+
+def _class_data_unsupported(archive):
+    """ return the path of the marker which tells that the java can't record or dump the class list of the archive
+    (e.g., Java 8), so that the checks don't try again."""
+    return archive + '.unsupported'
+
+
+def _jvm_environment(archive=None, class_list=None, vm_arguments=None):
+    """ return the environment for cpa.sh which makes the JVM map the class data sharing archive (if exists), or
+    record the loaded classes to class_list. cpachecker has no server mode, so a warm JVM can't be kept around to
+    accept new programs, instead the archive (application class data sharing, Java 10+) amortizes the class loading
+    part of JVM startup between launches. Unrecognized options are ignored so that older JVMs still work as before.
+    """
+    if vm_arguments is None:
+        if archive and os.path.exists(archive):
+            vm_arguments = '-Xshare:auto -XX:SharedArchiveFile={}'.format(archive)
+        elif class_list:
+            vm_arguments = '-XX:DumpLoadedClassList={}'.format(class_list)
+        else:
+            return None
+    # UseAppCDS is needed on Java 10 and ignored on the later versions
+    vm_arguments = '-XX:+IgnoreUnrecognizedVMOptions -XX:+UseAppCDS ' + vm_arguments
+    return dict(os.environ, JAVA_VM_ARGUMENTS=' '.join((os.environ.get('JAVA_VM_ARGUMENTS', ''), vm_arguments)).strip())
+
+
+async def _dump_class_data_archive(checkerpath, archive, class_list):
+    """ dump the classes in class_list (recorded by a solver run) into the class data sharing archive. The JVM is
+    started by cpa.sh with -Xshare:dump, so that the archive has the same class path as the solvers, and exits after
+    dumping. If the archive can't be dumped, the java is marked as unsupported.
+    """
+    import asyncio
+    temp = '{}.{}.tmp'.format(archive, os.getpid())
+    process = await asyncio.create_subprocess_exec(
+        checkerpath + '/scripts/cpa.sh',
+        env=_jvm_environment(vm_arguments='-Xshare:dump -XX:SharedClassListFile={} -XX:SharedArchiveFile={}'
+                             .format(class_list, temp)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        await asyncio.wait_for(process.wait(), DEFAULT_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        _kill(process)
+        await process.wait()
+    try:
+        if process.returncode == 0 and os.path.exists(temp) and os.path.getsize(temp) != 0:
+            os.replace(temp, archive)
+            logger.info('Class data sharing archive of the checker is dumped to {}'.format(archive))
+        else:
+            logger.debug('Cannot dump the class data sharing archive {}'.format(archive))
+            open(_class_data_unsupported(archive), 'w').close()
+    except OSError as e:
+        logger.debug('Cannot write the class data sharing archive {}: {}'.format(archive, e))
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def _job_slots(portfolio, jobs=None):
+    """ return the semaphore which bounds the jobs of a check running at the same time to jobs, default is the number
+    of cores / portfolio.max_concurrency since each job runs up to portfolio.max_concurrency solvers, so that all the
+    solvers fit in the cores."""
+    import asyncio
+    return asyncio.Semaphore(jobs if jobs else max(1, (os.cpu_count() or 1) // portfolio.max_concurrency))
+
+
+async def _check_obligations(checkerpath, path, source, args, use_cache, portfolio, workspace, keep, jobs):
+    """ verify each assertion of the transformed program as its own job, with the other assertions turned into
+    assumes. The program is verified if all the jobs are: on a path violating an assertion, the first violated one is
+    reached in its own job since the earlier ones hold. The jobs run in parallel (at most jobs at a time, see
+    _job_slots), and all stop as soon as one of them fails.
+    :return: Boolean indicating if all the assertions are verified.
+    """
+    import asyncio
+    obligations = _obligations(source)
+    is_multi_function = len(_entry_functions(source)) > 1
+    name = os.path.splitext(os.path.basename(path))[0]
+    logger.info('Start checking {} assertions of {} in parallel...'.format(len(obligations), path))
+    # the programs of the jobs are kept next to the solver outputs only if all of them are kept
+    directory = tempfile.mkdtemp(prefix='shadowdp-{}-assertions-'.format(name), dir=workspace if workspace else '.')
+    slots = _job_slots(portfolio, jobs)
+    verdicts, times = {}, {}
+
+    async def verify(index, obligation):
+        program = os.path.join(directory, '{}_{}.c'.format(name, index))
+        with open(program, 'w') as f:
+            f.write(_decompose(source, obligations, index))
+        async with slots:
+            start = time.time()
+            verdicts[index] = await check_async(checkerpath, program, args, use_cache, portfolio, workspace, keep,
+                                                obligation.function if is_multi_function else None)
+            times[index] = time.time() - start
+        return verdicts[index]
+
+    jobs = [asyncio.ensure_future(verify(index, obligation)) for index, obligation in enumerate(obligations)]
+    try:
+        for job in asyncio.as_completed(jobs):
+            if not await job:
+                break
+    finally:
+        for job in jobs:
+            job.cancel()
+        await asyncio.wait(jobs)
+        if keep != 'all':
+            shutil.rmtree(directory, ignore_errors=True)
+
+    for index, obligation in enumerate(obligations):
+        location = '{}:{}{}'.format(path, obligation.line,
+                                    ' ({})'.format(obligation.function) if obligation.function else '')
+        if index not in verdicts:
+            logger.info('{} {}: stopped'.format(location, obligation.condition))
+        elif verdicts[index]:
+            logger.info('{} {}: verified in {:.3f} seconds'.format(location, obligation.condition, times[index]))
+        else:
+            logger.warning('{} {}: not verified in {:.3f} seconds'.format(location, obligation.condition,
+                                                                          times[index]))
+    return len(verdicts) == len(obligations) and all(verdicts.values())
+
+
+async def check_async(checkerpath, path, args=None, use_cache=True, portfolio=None, workspace=None,
+                      keep='winner', function=None, decompose=False, jobs=None):
+    """ verify the transformed program with multiple solvers in parallel, as soon as one solver reports the verdict
+    (TRUE or FALSE), the others are killed.
+    :param checkerpath: The root directory of cpachecker.
+    :param path: The path of the transformed program.
+    :param args: The extra arguments for the checker.
+    :param use_cache: Whether to use the on-disk caches, i.e., the verdict cache, the JVM class data archive and
+    the history of the solvers.
+    :param portfolio: The Portfolio of solvers to run, default is all solvers at once with DEFAULT_TIMEOUT.
+    When fewer solvers than the portfolio can run at the same time, the ones most likely to verify the program
+    (according to the history) are launched first, and the others are launched only when a running one fails.
+    :param workspace: The directory to create the workspace of this check in, which holds the outputs of the
+    solvers, e.g., a tmpfs mount. Default is the current directory.
+    :param keep: One of RETENTION_POLICIES, the solver outputs to keep in the workspace when the check finishes,
+    the workspace is removed if nothing is left.
+    :param function: The entry function to verify. By default each function of a program with several functions is
+    verified as its own job (with the function as the entry) in parallel (at most the number of cores / the number of
+    concurrent solvers at a time), and a program with a single function is verified as is.
+    :param decompose: Whether to verify each assertion of the program as its own job, with the other assertions
+    turned into assumes, the jobs run in parallel until one of them fails.
+    :param jobs: The number of jobs (functions or assertions) running at the same time, default is the number of
+    cores / the number of concurrent solvers, e.g., 1 when the checks themselves already run in parallel.
+    :return: Boolean indicating if the program (i.e., all its functions) is verified.
+    """
+    import asyncio
+    if keep not in RETENTION_POLICIES:
+        raise ValueError('Retention policy should be one of {}, got {}'.format(', '.join(RETENTION_POLICIES), keep))
+    with open(path, 'rb') as f:
+        source = f.read()
+    text = source.decode('utf-8', errors='replace')
+    portfolio = portfolio if portfolio else parse_portfolio()
+    if function is None and decompose and len(_obligations(text)) > 1:
+        return await _check_obligations(checkerpath, path, text, args, use_cache, portfolio, workspace, keep, jobs)
+    if function is None:
+        functions = _entry_functions(text)
+        if len(functions) > 1:
+            logger.info('Start checking {} functions of {} in parallel ({})...'
+                        .format(len(functions), path, ', '.join(functions)))
+            slots = _job_slots(portfolio, jobs)
+
+            async def verify(name):
+                async with slots:
+                    return await check_async(checkerpath, path, args, use_cache, portfolio, workspace, keep, name)
+
+            verdicts = await asyncio.gather(*(verify(name) for name in functions))
+            for name, is_verified in zip(functions, verdicts):
+                logger.info('{} ({}) {}'.format(path, name, 'verified' if is_verified else 'not verified'))
+            return all(verdicts)
+
+    funcname = function if function else os.path.splitext(os.path.basename(path))[0]
+    program = '{} ({})'.format(path, function) if function else path
+    entry = ('-entryfunction', function) if function else ()
+    cache, cache_key = None, None
+    if use_cache:
+        cache = DiskCache('verdicts')
+        cache_key = DiskCache.key(source, _checker_revision(checkerpath), repr(SOLVERS),
+                                  ','.join(sorted(portfolio.solvers)), args if args else '', *entry)
+        cached = cache.get(cache_key)
+        if cached:
+            is_verified, verified_solver, verification_time = cached
+            if is_verified:
+                logger.info('{} verified with {} (cached).'.format(program, verified_solver))
+                logger.info('Verification finished in {} (cached)'.format(verification_time))
+            else:
+                logger.warning('No solvers can verify {} (cached), run with --no-cache to see the errors.'
+                               .format(program))
+            return is_verified
+
+    args = args.split(' ') if args else ''
+
+    history_cache, program_history, solver_history = None, {}, {}
+    pending = list(portfolio.solvers)
+    if use_cache:
+        history_cache = DiskCache('history')
+        program_history, solver_history = (history_cache.get(key, {}) for key in _history_keys(source, function))
+        pending = _order_solvers(portfolio.solvers, program_history, solver_history)
+
+    logger.info('Start checking {} with multiple solvers({}{})...'.format(
+        program, ', '.join(pending),
+        ', {} at a time'.format(portfolio.max_concurrency) if portfolio.max_concurrency < len(pending) else ''))
+    # each check has its own workspace so that concurrent checks of the programs with the same name don't collide
+    workdir = tempfile.mkdtemp(prefix='shadowdp-{}-'.format(funcname), dir=workspace if workspace else '.')
+    archive, class_list, is_class_list_recorded = None, None, False
+    if use_cache:
+        archive = _class_data_archive(checkerpath)
+        if os.path.exists(_class_data_unsupported(archive)):
+            archive = None
+        elif not os.path.exists(archive):
+            try:
+                os.makedirs(os.path.dirname(archive), exist_ok=True)
+                class_list = '{}.{}.{}.classlist'.format(archive, os.getpid(), os.path.basename(workdir))
+            except OSError as e:
+                # the archive is only an optimization, check without it
+                logger.debug('Cannot create the class data sharing archive {}: {}'.format(archive, e))
+                archive = None
+    loop = asyncio.get_event_loop()
+    solvers = OrderedDict()
+    started = {}
+    winners = []
+
+    def stop_others(winner):
+        # the verdict is found, no more solvers are needed, only the first solver reporting it is kept since the
+        # others may report theirs before being stopped
+        if len(winners) != 0:
+            return
+        winners.append(winner)
+        del pending[:]
+        for name, solver in solvers.items():
+            if name != winner:
+                solver.cancel()
+
+    def launch_next():
+        name = pending.pop(0)
+        # only the first solver records the classes for the archive
+        env = _jvm_environment(archive, class_list if len(solvers) == 0 else None) if archive else None
+        started[name] = loop.time()
+        solvers[name] = asyncio.ensure_future(_run_solver(checkerpath, path, os.path.join(workdir, name), name, args,
+                                                          entry, env, portfolio.timeouts[name],
+                                                          lambda: stop_others(name)))
+        return solvers[name]
 
     # get the results
     errors = set()
+    outcomes = OrderedDict()
     is_verified = False
     verified_solver = ''
-    for _ in range(len(processes)):
-        verified, name, out, err = results.get()
-        if verified:
-            logger.info('{} verified with {}.'.format(path, name))
-            # open and read report to find
-            with open('./output-{}-{}/Statistics.txt'.format(funcname, name)) as report:
-                all_report = report.read()
-                time = re.search(r'Total time for CPAchecker[:\s<>/a-zA-Z]*([0-9]+\.[0-9]+s)', all_report).groups()
-                logger.info('Verification finished in {}'.format(time[0]))
-            logger.info('CPA-Checker reports can be found at ./output-{}-{}'.format(funcname, name))
-            verified_solver = name
-            is_verified = True
-            break
-        else:
-            # log the error if this solver fails
-            errors.add((name, out, err))
-
-    # clean up threads and processes
-    for proc in processes.values():
-        proc.kill()
-        proc.wait()
-    for thread in threads:
-        thread.join()
+    verification_time = None
+    try:
+        while len(pending) != 0 and len(solvers) < portfolio.max_concurrency:
+            launch_next()
+        running = set(solvers.values())
+        while len(running) != 0:
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for name in [name for name, solver in solvers.items() if solver in done and not solver.cancelled()]:
+                outcome, out, err = solvers[name].result()
+                outcomes[name] = (outcome, loop.time() - started[name])
+                if outcome == 'verified':
+                    logger.info('{} verified with {}.'.format(program, name))
+                    # open and read report to find
+                    with open(os.path.join(workdir, name, 'Statistics.txt')) as report:
+                        all_report = report.read()
+                        verification_time = re.search(r'Total time for CPAchecker[:\s<>/a-zA-Z]*([0-9]+\.[0-9]+s)',
+                                                      all_report).groups()
+                        logger.info('Verification finished in {}'.format(verification_time[0]))
+                    logger.info('CPA-Checker reports can be found at {}'.format(os.path.join(workdir, name)))
+                    verified_solver = name
+                    is_verified = True
+                else:
+                    # log the error if this solver fails
+                    errors.add((name, out, err))
+                    # let the next solver take over
+                    if len(pending) != 0:
+                        logger.info('{} failed to verify the program, launching {}'.format(name, pending[0]))
+                        running.add(launch_next())
+    finally:
+        # clean up the processes
+        for solver in solvers.values():
+            solver.cancel()
+        if len(solvers) != 0:
+            await asyncio.wait(list(solvers.values()))
+        # remove the solver outputs according to the retention policy
+        if keep == 'none' or (keep == 'winner' and not is_verified):
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif keep == 'winner':
+            for name in solvers.keys():
+                if name != verified_solver:
+                    shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+        elif len(os.listdir(workdir)) == 0:
+            os.rmdir(workdir)
+        # the class list is complete only if the JVM exits normally, otherwise (e.g., killed or the check is
+        # cancelled) discard it
+        if class_list and len(solvers) != 0 and \
+                outcomes.get(next(iter(solvers)), ('timeout', ))[0] in ('verified', 'false'):
+            is_class_list_recorded = True
+        elif class_list and os.path.exists(class_list):
+            os.remove(class_list)
 
-    # remove failed solver output
-    for solver in ('MathSat', 'Z3', 'SMTInterpol'):
-        if solver != verified_solver:
-            shutil.rmtree('./output-{}-{}'.format(funcname, solver))
+    if is_class_list_recorded:
+        try:
+            if os.path.exists(class_list):
+                await _dump_class_data_archive(checkerpath, archive, class_list)
+            else:
+                # the JVM can't record the loaded classes
+                open(_class_data_unsupported(archive), 'w').close()
+        except OSError as e:
+            logger.debug('Cannot dump the class data sharing archive {}: {}'.format(archive, e))
+        finally:
+            if os.path.exists(class_list):
+                os.remove(class_list)
 
     # if no solvers can verify the program
     if not is_verified:
-        logger.warning('No solvers can verify the program, error messages shown below:')
+        logger.warning('No solvers can verify {}, error messages shown below:'.format(program))
         for name, out, err in errors:
             logger.warning('{}:\n\tout: {}\n\terr:{}'.format(name, out.decode('ascii'), err.decode('ascii')))
 
+    # record the outcomes of the finished solvers, the ones stopped because of the verdict tell nothing
+    # merged into the latest records, which the concurrent checks (in this loop or other processes) might have updated
+    # since they were read
+    if history_cache:
+        for key in _history_keys(source, function):
+            history_cache.update(key, lambda history: _record_history(history, outcomes), {})
+
+    # only store definitive verdicts, timeouts or crashes of the solvers might not happen next time
+    if cache and (is_verified or any(outcome == 'false' for outcome, _ in outcomes.values())):
+        cache.set(cache_key, (is_verified, verified_solver, verification_time[0] if verification_time else None))
+
     return is_verified
+
+
+def check(checkerpath, path, args=None, use_cache=True, portfolio=None, workspace=None, keep='winner',
+          decompose=False, jobs=None):
+    """ verify the transformed program with multiple solvers in parallel, see check_async for details.
+    :return: Boolean indicating if the program is verified.
+    """
+    # asyncio is imported on first use like z3 in core, since importing it is slow and it isn't needed to transform
+    import asyncio
+    loop = asyncio.new_event_loop()
+    # set as the current loop so that the child watcher reaps the solvers on it
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(check_async(checkerpath, path, args, use_cache, portfolio,
+                                                   workspace, keep, decompose=decompose, jobs=jobs))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -19,30 +19,46 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import sympy as sp
 import logging
 import copy
 import re
-import z3
+import time
+from collections import OrderedDict
 from pycparser import c_ast
 from pycparser.c_generator import CGenerator
 from pycparser.c_ast import NodeVisitor
-from shadowdp.typesystem import TypeSystem, convert_to_ast, is_node_equal
+from shadowdp.typesystem import TypeSystem, convert_to_ast, is_node_equal, intern_node, simplify_expression
 from shadowdp.exceptions import *
+from shadowdp.cache import DiskCache
+from shadowdp import profiler
+from shadowdp.profiler import phase, profiled
 logger = logging.getLogger(__name__)
 
 _code_generator = CGenerator()
 
+# the milliseconds a query may take in the incremental solver session of a function, which might not finish some
+# (satisfiable) quantified queries that a fresh solver answers right away, and then in the fresh solver, which might
+# not finish others in turn, see ShadowDPTransformer._z3_check
+_Z3_SESSION_TIMEOUT = 1000
+_Z3_TIMEOUT = 10000
+
+
+def _z3():
+    """ z3 is imported on first use since importing it is slow and it isn't needed until a branch condition or a
+    sampling command is checked, see also _simplify in typesystem. """
+    import z3
+    return z3
+
 
 # TODO: refactor the z3 constraint generation for better structure
 class _Z3ExpressionGenerator(NodeVisitor):
     BINARYOP_MAP = {
         '+': lambda x, y: x + y, '-': lambda x, y: x - y, '/': lambda x, y: x / y, '*': lambda x, y: x * y,
         '>': lambda x, y: x > y, '>=': lambda x, y: x >= y, '<': lambda x, y: x < y, '<=': lambda x, y: x <= y,
-        '==': lambda x, y: x == y, '&&': lambda x, y: z3.And(x, y), '||': lambda x, y: z3.Or(x, y)
+        '==': lambda x, y: x == y, '&&': lambda x, y: _z3().And(x, y), '||': lambda x, y: _z3().Or(x, y)
     }
     UNARYOP_MAP = {
-        '!': lambda x: z3.Not(x),
+        '!': lambda x: _z3().Not(x),
         '-': lambda x: -x
     }
 
@@ -57,10 +73,12 @@ class _Z3ExpressionGenerator(NodeVisitor):
 
     def visit_Constant(self, node):
         assert isinstance(node, c_ast.Constant)
+        z3 = _z3()
         return z3.RealVal(node.value), z3.RealVal(node.value), z3.RealVal(node.value)
 
     # TODO: the following two methods should be refactored to support more scenarios
     def visit_ID(self, node):
+        z3 = _z3()
         if node.name not in self._types or (self._replaces and node.name in self._replaces):
             align, shadow = '*', '*'
         else:
@@ -72,6 +90,7 @@ class _Z3ExpressionGenerator(NodeVisitor):
 
     def visit_ArrayRef(self, node):
         assert isinstance(node, c_ast.ArrayRef)
+        z3 = _z3()
         if node.name.name not in self._types:
             align, shadow = '*', '*'
         else:
@@ -95,6 +114,7 @@ class _Z3ExpressionGenerator(NodeVisitor):
 
     def visit_TernaryOp(self, node):
         assert isinstance(node, c_ast.TernaryOp)
+        z3 = _z3()
         conds = self.visit(node.cond)
         trues = self.visit(node.iftrue)
         falses = self.visit(node.iffalse)
@@ -122,6 +142,66 @@ class _NodeFinder(NodeVisitor):
             self.generic_visit(child)
 
 
+class _RewritePlan:
+    """ this class records the statements to be inserted into a block and inserts them in one pass when applied,
+    instead of shifting the block items on every insertion. Insertions are positioned as if they were made on the
+    block items right away, e.g., insert_front(...) inserts the statements at the position after the leading assume
+    function calls of current items. The statements are inserted before / after the statements of the block being
+    transformed, and only insert_front(...) inserts assume function calls."""
+    def __init__(self, block, assume):
+        self._block = block
+        self._assume = assume
+        # the items before the first non-assume item (front), followed by the statements inserted at the start index
+        # whose first item is not an assume call, as chunks in the reversed order (back)
+        count = self._count_assumes(block.block_items)
+        self._front, self._back = block.block_items[:count], []
+        self._items = block.block_items[count:]
+        # id(item) -> statements inserted before / after the item, and the statements appended to the block
+        self._before, self._after, self._end = {}, {}, []
+
+    def _count_assumes(self, statements):
+        """ count the leading assume function calls of the statements """
+        for index, statement in enumerate(statements):
+            if not (isinstance(statement, c_ast.FuncCall) and statement.name.name == self._assume):
+                return index
+        return len(statements)
+
+    def insert_before(self, node, statements):
+        self._before.setdefault(id(node), []).extend(statements)
+
+    def insert_after(self, node, statement):
+        # each statement is inserted right after the node, i.e., before the statements inserted after it earlier
+        self._after.setdefault(id(node), []).insert(0, statement)
+
+    def insert_front(self, statements):
+        """ insert the statements after the leading assume function calls of the block """
+        count = self._count_assumes(statements)
+        if self._back or self._items or self._end:
+            self._front.extend(statements[:count])
+            if count < len(statements):
+                self._back.append(statements[count:])
+        elif count == len(statements):
+            # all items are assume function calls, in which case the statements are inserted at the beginning
+            self._front[:0] = statements
+        else:
+            self._back.extend((self._front, statements[count:]))
+            self._front = list(statements[:count])
+
+    def extend(self, statements):
+        self._end.extend(statements)
+
+    def apply(self):
+        items = self._front
+        for chunk in reversed(self._back):
+            items.extend(chunk)
+        for item in self._items:
+            items.extend(self._before.get(id(item), ()))
+            items.append(item)
+            items.extend(self._after.get(id(item), ()))
+        items.extend(self._end)
+        self._block.block_items[:] = items
+
+
 class _ShadowBranchGenerator(NodeVisitor):
     """ this class generates the shadow branch statement"""
     def __init__(self, shadow_variables, types):
@@ -218,11 +298,7 @@ class _DistanceGenerator(NodeVisitor):
         assert isinstance(self._types, TypeSystem)
 
     def try_simplify(self, expr):
-        from sympy import simplify
-        try:
-            expr = str(simplify(expr))
-        finally:
-            return expr
+        return simplify_expression(expr)
 
     def generic_visit(self, node):
         raise NotImplementedError
@@ -250,13 +326,15 @@ class _DistanceGenerator(NodeVisitor):
 
 class ShadowDPTransformer(NodeVisitor):
     """ Traverse the AST and do necessary transformations on the AST according to the typing rules."""
-    def __init__(self, function_map=None, set_epsilon=None, set_goal=None):
+    def __init__(self, function_map=None, set_epsilon=None, set_goal=None, query_cache=None):
         """ Initialize the transformer.
         :param function_map: A dict containing a mapping from logical commands (assert / assume / havoc)
         to actual commands (e.g., __VERIFIER_assert in CPAChecker), this is an abstraction for use with other
         verification tools that may have other names for assert / assume / havoc commands.
         :param set_epsilon: boolean value indicating if we want to set epsilon to 1 to overcome the non-linearity issue.
         :param set_goal: number indicating the goal to verify the algorithm, e.g., 2 means to verify 2 * epsilon-DP.
+        :param query_cache: A DiskCache to store the results of the z3 queries in, so that the same queries (e.g., of
+        the variants of a mechanism) are not solved again, None means always running z3.
         """
         super().__init__()
 
@@ -292,7 +370,20 @@ class ShadowDPTransformer(NodeVisitor):
         self._pc = False
         self._no_shadow = False
         # to track the inserted assume functions so that we don't have to insert redundent assumes
-        self._inserted_query_assumes = [[]]
+        self._inserted_query_assumes = [set()]
+        # the pending insertions of the blocks of current function, id(block) -> _RewritePlan, see _plan
+        self._plans = {}
+        # the results of statements analyzed during loop fixed point iterations, see visit_Compound
+        self._loop_memo = {}
+        # statistics of loop fixed point iterations, (function name, line) -> statistics
+        self.loop_statistics = OrderedDict()
+        self._function_name = None
+        # z3 solver session of current function with the precondition asserted, see _z3_session
+        self._z3_solver = None
+        self._z3_precondition_formula = None
+        self._z3_replaces = None
+        self._z3_precondition_key = None
+        self._query_cache = query_cache
 
     def _update_pc(self, pc, types, condition):
         if self._no_shadow:
@@ -306,11 +397,11 @@ class ShadowDPTransformer(NodeVisitor):
                            types.get_distance(node.name)[1] == '*')))
         if len(star_variable_finder.visit(condition)) != 0:
             return True
-        precondition, replaces = self._z3_precondition()
+        z3 = _z3()
+        _, replaces = self._z3_session()
         original, align, shadow = _Z3ExpressionGenerator(types, replaces).visit(condition)
-        solver = z3.Solver()
-        solver.add(z3.Not(z3.Implies(precondition, original == shadow)))
-        return solver.check() != z3.unsat
+        # check if precondition => (original == shadow) is valid
+        return self._z3_check(original != shadow) != z3.unsat
 
     # Instrumentation rule
     def _instrument(self, types1, types2, pc):
@@ -339,14 +430,26 @@ class ShadowDPTransformer(NodeVisitor):
 
         return assumes, inserted_statement
 
-    def _start_index(self, block_item):
-        """ find the start index of block_item that is not assume function"""
-        for index, node in enumerate(block_item):
-            if not (isinstance(node, c_ast.FuncCall) and node.name.name == self._func_map['assume']):
-                return index
-        return 0
+    def _plan(self, block):
+        """ return the rewrite plan of the block, the insertions are applied after the function is transformed to
+        keep the transformation linear in the length of the blocks."""
+        plan = self._plans.get(id(block))
+        if plan is None:
+            plan = self._plans[id(block)] = _RewritePlan(block, self._func_map['assume'])
+        return plan
+
+    def _apply_plans(self, node=None):
+        """ apply the pending insertions of the blocks in the given node, or of all blocks if node is None """
+        if node is None:
+            plans, self._plans = self._plans.values(), {}
+        else:
+            plans = [self._plans.pop(id(block)) for block in _NodeFinder(
+                lambda to_check: isinstance(to_check, c_ast.Compound)).visit(node) if id(block) in self._plans]
+        for plan in plans:
+            plan.apply()
 
     def _z3_precondition(self):
+        z3 = _z3()
         _, _, q, *_ = self._parameters
         aligned_distance_query = z3.Array('__SHADOWDP_ALIGNED_DISTANCE_{}'.format(q), z3.RealSort(), z3.RealSort())
         shadow_distance_query = z3.Array('__SHADOWDP_SHADOW_DISTANCE_{}'.format(q), z3.RealSort(), z3.RealSort())
@@ -363,6 +466,55 @@ class ShadowDPTransformer(NodeVisitor):
             return z3.ForAll(i, z3.And(z3.And(-1 <= aligned_distance_query[i], aligned_distance_query[i] <= 1),
                                        shadow_distance_query[i] == aligned_distance_query[i])), replaces
 
+    def _z3_session(self):
+        """ return the incremental solver session of current function where the (quantified) precondition is asserted
+        only once, each query should be checked in its own push / pop scope, see _z3_check.
+        :return: (solver, replaces) where replaces is the same as in _z3_precondition
+        """
+        if self._z3_solver is None:
+            z3 = _z3()
+            self._z3_precondition_formula, self._z3_replaces = self._z3_precondition()
+            self._z3_solver = z3.Solver()
+            self._z3_solver.set('timeout', _Z3_SESSION_TIMEOUT)
+            self._z3_solver.add(self._z3_precondition_formula)
+            # the precondition is the same for all queries of the function, so it is serialized once for the cache
+            self._z3_precondition_key = DiskCache.key(self._z3_solver.sexpr()) if self._query_cache is not None \
+                else None
+        return self._z3_solver, self._z3_replaces
+
+    def _z3_check(self, *constraints):
+        """ check the constraints under the precondition in the solver session of current function. The results are
+        looked up in the query cache first, keyed by the s-expressions of the precondition and the constraints (the
+        names of the variables determine their sorts) and the version of z3. The queries the session gives up on (see
+        _Z3_SESSION_TIMEOUT) are checked again in a fresh solver with the precondition.
+        :return: z3.sat, z3.unsat or z3.unknown if neither solver finishes, which the callers take as not proven
+        """
+        z3 = _z3()
+        solver, _ = self._z3_session()
+        key = None
+        if self._query_cache is not None:
+            key = DiskCache.key(z3.get_version_string(), self._z3_precondition_key,
+                                *(constraint.sexpr() for constraint in constraints))
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                profiler.count('z3_cache_hit')
+                return z3.sat if cached == 'sat' else z3.unsat
+        with phase('z3'):
+            solver.push()
+            solver.add(*constraints)
+            result = solver.check()
+            solver.pop()
+            if result == z3.unknown:
+                profiler.count('z3_session_fallback')
+                solver = z3.Solver()
+                solver.set('timeout', _Z3_TIMEOUT)
+                solver.add(self._z3_precondition_formula, *constraints)
+                result = solver.check()
+        # unknown results (e.g., due to resource limits) are not cached
+        if key is not None and result != z3.unknown:
+            self._query_cache.set(key, str(result))
+        return result
+
     def _assume_query(self, query_node):
         """ instrument assume functions of query input (sensitivity guarantee) """
         assume_functions = []
@@ -424,10 +576,10 @@ class ShadowDPTransformer(NodeVisitor):
         else:
             assume_functions = common_assume
         # if assume function has already been inserted in this scope
-        for inserted in self._inserted_query_assumes[-1]:
-            if is_node_equal(query_node.subscript, inserted):
-                return []
-        self._inserted_query_assumes[-1].append(query_node.subscript)
+        subscript = intern_node(query_node.subscript)
+        if subscript in self._inserted_query_assumes[-1]:
+            return []
+        self._inserted_query_assumes[-1].add(subscript)
         return assume_functions
 
     def visit_Compound(self, node):
@@ -436,11 +588,30 @@ class ShadowDPTransformer(NodeVisitor):
         for child in tuple(node.block_items):
             # meanwhile, mark this node as its children's parent, as they may need to modify this block_items list
             self._parents[child] = node
-            self.visit(child)
+            if self._loop_level > 0:
+                # during loop fixed point iterations statements don't modify the AST, the resulting types only depend
+                # on the types and pc before the statement, so only re-analyze the statements whose inputs change,
+                # this also memoizes the summaries of inner loops. The memo holds the statements (rather than their ids,
+                # which could be reused) and is cleared for each function, see visit_FuncDef
+                key = (child, self._types.signature(), self._pc, frozenset(self._random_variables))
+                if key in self._loop_memo:
+                    profiler.count('loop_memo_hit')
+                    self._types = self._loop_memo[key].copy()
+                else:
+                    self.visit(child)
+                    self._loop_memo[key] = self._types.copy()
+            else:
+                self.visit(child)
 
     def visit_FuncDef(self, node):
-        # the start of the transformation
+        # the start of the transformation, each function is transformed independently
         self._types.clear()
+        self._parameters = []
+        self._random_variables = set()
+        self._z3_solver = None
+        self._loop_memo.clear()
+        self._plans.clear()
+        self._function_name = node.decl.name
         logger.info('Start transforming function {} ...'.format(node.decl.name))
 
         # first go through the function to see if shadow execution is used or not
@@ -566,9 +737,11 @@ class ShadowDPTransformer(NodeVisitor):
                                 dim=None, dim_quals=[]), init=None, quals=[], funcspec=[], bitsize=[], storage=[])
                         )
 
-        # prepend the inserted statements
+        # apply the insertions and prepend the inserted statements
+        self._apply_plans()
         node.body.block_items[:0] = insert_statements
 
+    @profiled('visit_Assignment')
     def visit_Assignment(self, node):
         logger.debug('Line {}: {}'.format(str(node.coord.line), _code_generator.visit(node)))
         varname = node.lvalue.name if isinstance(node.lvalue, c_ast.ID) else node.lvalue.name.name
@@ -588,8 +761,7 @@ class ShadowDPTransformer(NodeVisitor):
                 # insert x^shadow = x + x^shadow - e;
                 insert_node = c_ast.Assignment(op='=', lvalue=shadow_distance, rvalue=c_ast.BinaryOp(
                     op='-', left=c_ast.BinaryOp(op='+', left=node.lvalue, right=shadow_distance), right=node.rvalue))
-                node_index = parent.block_items.index(node)
-                parent.block_items.insert(node_index, insert_node)
+                self._plan(parent).insert_before(node, (insert_node, ))
 
             # check the distance dependence
             dependence_finder = _NodeFinder(
@@ -597,8 +769,10 @@ class ShadowDPTransformer(NodeVisitor):
                                  (isinstance(to_check, c_ast.ArrayRef) and to_check.name.name == varname),
                 lambda to_ignore: isinstance(to_ignore, c_ast.ID) and to_ignore.name in self._random_variables
             )
-            for name, (align, shadow) in self._types.variables():
+            # only the distances mentioning the variable can depend on it, which are confirmed by the finder
+            for name in self._types.dependents(varname):
                 if name not in self._random_variables:
+                    align, shadow = self._types.get_distance(name)
                     is_align_dependent = False if align == '*' \
                         else len(dependence_finder.visit(convert_to_ast(align))) != 0
                     # no need to check shadow dependence if shadow execution is never used
@@ -610,11 +784,9 @@ class ShadowDPTransformer(NodeVisitor):
                         before = self._types.copy()
                         self._types.update_distance(name, *new_distances)
                         assumes, inserts = self._instrument(before, self._types, self._pc)
-                        block_items = parent.block_items
-                        start_index = self._start_index(block_items)
-                        block_items[start_index:start_index] = assumes
-                        node_index = block_items.index(node)
-                        block_items[node_index:node_index] = inserts
+                        plan = self._plan(parent)
+                        plan.insert_front(assumes)
+                        plan.insert_before(node, inserts)
                         logger.debug('Distance dependence encountered (distance of {0} depends on {1}: {{{0}: {2}}})'
                                      ', resolved by promoting to *'
                                      .format(name, varname, align if is_align_dependent else shadow))
@@ -627,6 +799,7 @@ class ShadowDPTransformer(NodeVisitor):
             self._types.update_distance(node.lvalue.name, aligned, shadow)
         logger.debug('types: {}'.format(self._types))
 
+    @profiled('visit_Decl')
     def visit_Decl(self, node):
         logger.debug('Line {}: {}'.format(str(node.coord.line), _code_generator.visit(node)))
 
@@ -666,16 +839,14 @@ class ShadowDPTransformer(NodeVisitor):
 
                 # do injectivity check
                 distance_node = convert_to_ast(distance_eta)
-                precondition, replaces = self._z3_precondition()
+                z3 = _z3()
+                _, replaces = self._z3_session()
                 eta1, eta2 = z3.Reals('__SHADOWDP_Z3_eta_1 __SHADOWDP_Z3_eta_2')
                 (z3_distance_1, *_), (z3_distance_2, *_) = \
                     _Z3ExpressionGenerator(self._types, {node.name: eta1, **replaces}).visit(distance_node), \
                     _Z3ExpressionGenerator(self._types, {node.name: eta2, **replaces}).visit(distance_node)
-                solver = z3.Solver()
-                solver.add(z3.Not(
-                    z3.Implies(precondition, z3.Implies(eta1 + z3_distance_1 == eta2 + z3_distance_2, eta1 == eta2))
-                ))
-                if solver.check() != z3.unsat:
+                # check if precondition => (eta1 + distance1 == eta2 + distance2 => eta1 == eta2) is valid
+                if self._z3_check(eta1 + z3_distance_1 == eta2 + z3_distance_2, eta1 != eta2) != z3.unsat:
                     raise SamplingCommandInjectivityError(node.coord, node.name, distance_eta)
 
                 # set the random variable distance
@@ -709,7 +880,7 @@ class ShadowDPTransformer(NodeVisitor):
                 if self._loop_level == 0:
                     # insert cost variable update statement and transform sampling command to havoc command
                     assert isinstance(self._parents[node], c_ast.Compound)
-                    n_index = self._parents[node].block_items.index(node)
+                    plan = self._plan(self._parents[node])
                     scale = _code_generator.visit(node.init.args.exprs[0])
                     # incorporate epsilon = 1 approach
                     if self._set_epsilon:
@@ -723,11 +894,7 @@ class ShadowDPTransformer(NodeVisitor):
                     transformed = []
                     for piece in pieces:
                         if len(re.findall(r'[=><\\|&?:]', piece)) == 0:
-                            cost_expr = '(Abs({}) * (1/({})))'.format(piece, scale)\
-                                .replace('[', '__LEFTBRACE__').replace(']', '__RIGHTBRACE__')
-                            cost = str(sp.simplify(cost_expr))
-                            cost = cost.replace('__LEFTBRACE__', '[').replace('__RIGHTBRACE__', ']')
-                            transformed.append(cost)
+                            transformed.append(simplify_expression('(Abs({}) * (1/({})))'.format(piece, scale)))
                         else:
                             transformed.append(piece)
 
@@ -744,12 +911,9 @@ class ShadowDPTransformer(NodeVisitor):
                         lambda node: isinstance(node, c_ast.ArrayRef) and '__SHADOWDP_' in node.name.name and
                                      self._parameters[2] in node.name.name)
 
-                    self._parents[node].block_items.insert(n_index + 1, update_v_epsilon)
+                    plan.insert_after(node, update_v_epsilon)
                     for query_node in query_var_checker.visit(update_v_epsilon):
-                        assume_functions = self._assume_query(query_node)
-                        block_item = self._parents[node].block_items
-                        start_index = self._start_index(block_item)
-                        block_item[start_index:start_index] = assume_functions
+                        plan.insert_front(self._assume_query(query_node))
 
                     # transform sampling command to havoc command
                     node.init = c_ast.FuncCall(c_ast.ID(self._func_map['havoc']), args=None)
@@ -764,6 +928,7 @@ class ShadowDPTransformer(NodeVisitor):
 
         logger.debug('types: {}'.format(self._types))
 
+    @profiled('visit_If')
     def visit_If(self, n):
         logger.debug('types(before branch): {}'.format(self._types))
         logger.debug('Line {}: if({})'.format(n.coord.line, _code_generator.visit(n.cond)))
@@ -775,7 +940,7 @@ class ShadowDPTransformer(NodeVisitor):
         # backup the current types before entering the true or false branch
         before_types = self._types.copy()
 
-        self._inserted_query_assumes.append([])
+        self._inserted_query_assumes.append(set())
         # add current condition for simplification
         self._types.apply(n.cond, True)
         # to be used in if branch transformation assert(e^aligned);
@@ -786,7 +951,7 @@ class ShadowDPTransformer(NodeVisitor):
         logger.debug('types(true branch): {}'.format(true_types))
         true_assumes = self._inserted_query_assumes.pop()
 
-        self._inserted_query_assumes.append([])
+        self._inserted_query_assumes.append(set())
         # revert current types back to enter the false branch
         self._types = before_types
         self._types.apply(n.cond, False)
@@ -809,6 +974,10 @@ class ShadowDPTransformer(NodeVisitor):
             if self._pc and not before_pc:
                 # insert c_shadow
                 shadow_cond = _ExpressionReplacer(self._types, False).visit(copy.deepcopy(n.cond))
+                # the branches are copied with the insertions made by their statements
+                self._apply_plans(n.iftrue)
+                if n.iffalse:
+                    self._apply_plans(n.iffalse)
                 shadow_branch = c_ast.If(
                     cond=shadow_cond, iftrue=c_ast.Compound(block_items=copy.deepcopy(n.iftrue.block_items)),
                     iffalse=c_ast.Compound(block_items=copy.deepcopy(n.iffalse.block_items)) if n.iffalse else None)
@@ -816,52 +985,45 @@ class ShadowDPTransformer(NodeVisitor):
                     {name for name, (_, shadow) in self._types.variables() if shadow == '*'},
                     self._types)
                 shadow_branch_generator.visit(shadow_branch)
-                if_index = self._parents[n].block_items.index(n)
-                self._parents[n].block_items.insert(if_index + 1, shadow_branch)
+                plan = self._plan(self._parents[n])
+                plan.insert_after(n, shadow_branch)
 
                 # insert assume functions at the beginning of the scope
                 for query_node in exp_checker.visit(shadow_cond):
-                    assume_functions = self._assume_query(query_node)
-                    block_item = self._parents[n].block_items
-                    start_index = self._start_index(block_item)
-                    block_item[start_index:start_index] = assume_functions
+                    plan.insert_front(self._assume_query(query_node))
 
             # create else branch if doesn't exist
             n.iffalse = n.iffalse if n.iffalse else c_ast.Compound(block_items=[])
 
             # insert assert and assume functions to corresponding branch
             for aligned_cond in (aligned_true_cond, aligned_false_cond):
-                block_items = n.iftrue.block_items if aligned_cond is aligned_true_cond else n.iffalse.block_items
+                plan = self._plan(n.iftrue if aligned_cond is aligned_true_cond else n.iffalse)
                 # insert the assertion
                 assert_body = c_ast.ExprList(exprs=[aligned_cond]) if aligned_cond is aligned_true_cond else \
                     c_ast.UnaryOp(op='!', expr=c_ast.ExprList(exprs=[aligned_cond]))
 
-                start_index = self._start_index(block_items)
-                block_items.insert(start_index, c_ast.FuncCall(name=c_ast.ID(self._func_map['assert']),
-                                                               args=assert_body))
+                plan.insert_front((c_ast.FuncCall(name=c_ast.ID(self._func_map['assert']), args=assert_body), ))
                 # if the expression contains `query` variable,
                 # add assume functions on __SHADOWDP_ALIGNED_DISTANCE_query and __SHADOWDP_SHADOW_DISTANCE_query
                 inserted = true_assumes if aligned_cond is aligned_true_cond else false_assumes
                 self._inserted_query_assumes.append(inserted)
                 for query_node in exp_checker.visit(aligned_cond):
-                    assume_functions = self._assume_query(query_node)
-                    start_index = self._start_index(block_items)
-                    block_items[start_index:start_index] = assume_functions
+                    plan.insert_front(self._assume_query(query_node))
                 self._inserted_query_assumes.pop()
 
             # instrument statements for updating aligned or shadow distance variables (Instrumentation rule)
             for types in (true_types, false_types):
-                block_items = n.iftrue.block_items if types is true_types else n.iffalse.block_items
+                plan = self._plan(n.iftrue if types is true_types else n.iffalse)
                 inserted = true_assumes if types is true_types else false_assumes
                 self._inserted_query_assumes.append(inserted)
                 assumes, inserts = self._instrument(types, self._types, self._pc)
-                start_index = self._start_index(block_items)
-                block_items[start_index:start_index] = assumes
-                block_items.extend(inserts)
+                plan.insert_front(assumes)
+                plan.extend(inserts)
                 self._inserted_query_assumes.pop()
 
         self._pc = before_pc
 
+    @profiled('visit_While')
     def visit_While(self, node):
         before_pc = self._pc
         self._pc = self._update_pc(self._pc, self._types, node.cond)
@@ -870,24 +1032,37 @@ class ShadowDPTransformer(NodeVisitor):
 
         fixed_types = None
         # don't output logs while doing iterations
-        logger.disabled = True
+        is_logger_disabled, logger.disabled = logger.disabled, True
         self._loop_level += 1
+        start, iterations = time.time(), 0
         while fixed_types != self._types:
             fixed_types = self._types.copy()
             self.generic_visit(node)
             self._types.merge(fixed_types)
-        logger.disabled = False
+            iterations += 1
+        logger.disabled = is_logger_disabled
         self._loop_level -= 1
 
+        # record the convergence statistics, inner loops might run multiple times (once per outer iteration)
+        statistics = self.loop_statistics.setdefault(
+            (self._function_name, node.coord.line), {'runs': 0, 'iterations': 0, 'seconds': 0.0})
+        seconds = time.time() - start
+        statistics['runs'] += 1
+        statistics['iterations'] += iterations
+        statistics['seconds'] += seconds
+        profiler.record_loop('{}:{}'.format(self._function_name, node.coord.line), iterations, seconds)
+
         if self._loop_level == 0:
-            self._inserted_query_assumes.append([])
+            self._inserted_query_assumes.append(set())
             logger.debug('Line {}: while({})'.format(node.coord.line, _code_generator.visit(node.cond)))
             logger.debug('types(fixed point): {}'.format(self._types))
+            logger.debug('Fixed point reached in {} iterations ({:.3f} seconds)'.format(iterations, seconds))
             aligned_cond = _ExpressionReplacer(self._types, True).visit(
                 copy.deepcopy(node.cond))
             assertion = c_ast.FuncCall(name=c_ast.ID(self._func_map['assert']),
                                        args=c_ast.ExprList(exprs=[aligned_cond]))
 
+            # the body is not modified yet, so the assertion can be inserted directly
             node.stmt.block_items.insert(0, assertion)
             self.generic_visit(node)
             after_visit = self._types.copy()
@@ -896,18 +1071,15 @@ class ShadowDPTransformer(NodeVisitor):
 
             # instrument c_s part
             assumes, c_s = self._instrument(before_types, self._types, self._pc)
-            block_items = self._parents[node].block_items
-            start_index = self._start_index(block_items)
-            block_items[start_index:start_index] = assumes
-            while_index = block_items.index(node)
-            block_items[while_index:while_index] = c_s
+            plan = self._plan(self._parents[node])
+            plan.insert_front(assumes)
+            plan.insert_before(node, c_s)
 
             # instrument c'' part
             assumes, update_statements = self._instrument(after_visit, self._types, self._pc)
-            block_items = node.stmt.block_items
-            start_index = self._start_index(block_items)
-            block_items[start_index:start_index] = assumes
-            block_items.extend(update_statements)
+            plan = self._plan(node.stmt)
+            plan.insert_front(assumes)
+            plan.extend(update_statements)
 
             # TODO: while shadow branch
             if self._pc and not before_pc:
@@ -939,4 +1111,4 @@ class ShadowDPTransformer(NodeVisitor):
             assert_node = c_ast.FuncCall(c_ast.ID(self._func_map['assert']),
                                          args=c_ast.ExprList([c_ast.BinaryOp('<=', c_ast.ID('__SHADOWDP_v_epsilon'),
                                                                              epsilon_node)]))
-        self._parents[node].block_items.insert(self._parents[node].block_items.index(node), assert_node)
+        self._plan(self._parents[node]).insert_before(node, (assert_node, ))
@@ -0,0 +1,220 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+""" Generator of annotated ShadowDP programs of configurable size with known verdicts, for scaling and stress tests.
+
+A generated program runs a sparse vector or noisy max loop (see examples/original), followed by samples noisy sums
+(each over queries query answers) chained one after another, and returns the sum of all the noisy results, with the
+privacy budget split equally among the mechanisms. The loop can have nested (non-private) while loops, nested branches
+and extra statements on extra variables, none of which affects the privacy cost. If private is False, the noise of the
+last mechanism is halved, so its cost doubles and the total cost exceeds epsilon on some executions, i.e., the
+transformed program can't be verified.
+
+    python -m shadowdp.generator OUTDIR [--count 10] [--seed 0]
+"""
+from collections import namedtuple
+import argparse
+import os
+import random
+import sys
+
+# name: the function name, source: the code, epsilon / goal: the options to transform it with,
+# verdict: whether the program satisfies goal * epsilon-differential privacy, i.e., whether it should be verified
+Program = namedtuple('Program', ('name', 'source', 'epsilon', 'goal', 'verdict'))
+
+MECHANISMS = ('sparsevector', 'noisymax', None)
+ADJACENCIES = ('ALL_DIFFER', 'ONE_DIFFER')
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+        self.indent = 0
+
+    def emit(self, *lines):
+        self.lines.extend('  ' * self.indent + line for line in lines)
+
+    def open(self, header):
+        self.emit(header, '{')
+        self.indent += 1
+
+    def close(self):
+        self.indent -= 1
+        self.emit('}')
+
+
+def _scale(value):
+    return '{:g}'.format(value) if value != int(value) else '{}.0'.format(int(value))
+
+
+def _loop_body(writer, loops, variables):
+    """ emit loops - 1 nested non-private while loops."""
+    for level in range(1, loops):
+        writer.emit('int j_{} = 0;'.format(level))
+        writer.open('while (j_{} < size)'.format(level))
+    for level in reversed(range(1, loops)):
+        if variables != 0:
+            writer.emit('v_0 = v_0 + j_{};'.format(level))
+        writer.emit('j_{0} = j_{0} + 1;'.format(level))
+        writer.close()
+
+
+def _branches(writer, depth, variables, statements, index):
+    """ emit depth - 1 nested non-private branches (the caller opens the outermost one) with the statements in the
+    innermost one, and close them."""
+    for level in range(1, depth):
+        writer.open('if ({} > {})'.format(index, level))
+    writer.emit(*('v_{0} = v_{0} + q[{1}];'.format(statement % variables, index) for statement in range(statements)))
+    for _ in range(1, depth):
+        writer.close()
+
+
+def generate(name='generated', queries=1, samples=1, mechanism='sparsevector', depth=1, loops=1, variables=0,
+             statements=0, adjacency='ALL_DIFFER', private=True):
+    """ generate a program with known verdict, see the module documentation for the structure.
+    :param name: The function name.
+    :param queries: The number of query answers in each noisy sum.
+    :param samples: The number of chained noisy sums (Lap samples with ALIGNED selectors).
+    :param mechanism: The loop mechanism before the noisy sums, one of MECHANISMS. noisymax uses SHADOW selectors.
+    :param depth: The depth of the nested branches in the loop, which needs statements to put in the branches.
+    :param loops: The depth of the nested while loops, counting the loop of the mechanism.
+    :param variables: The number of extra variables.
+    :param statements: The number of extra statements (assignments to the extra variables) in the innermost branch.
+    :param adjacency: ALL_DIFFER or ONE_DIFFER.
+    :param private: Whether the program should satisfy epsilon-differential privacy (and be verified).
+    :return: Program.
+    """
+    if mechanism not in MECHANISMS:
+        raise ValueError('Mechanism should be one of {}, got {}'.format(MECHANISMS, mechanism))
+    if adjacency not in ADJACENCIES:
+        raise ValueError('Adjacency should be one of {}, got {}'.format(ADJACENCIES, adjacency))
+    if samples == 0 and mechanism is None:
+        raise ValueError('At least one noisy sum or a mechanism is needed')
+    if queries < 1 or depth < 1 or loops < 1 or samples < 0 or variables < 0 or statements < 0:
+        raise ValueError('Sizes should be positive')
+    if statements != 0 and variables == 0:
+        raise ValueError('Statements need at least one variable to assign to')
+    if depth > 1 and statements == 0:
+        raise ValueError('Nested branches need at least one statement')
+
+    # split the budget among all mechanisms, the last one gets half of its noise if not private
+    mechanisms = samples + (1 if mechanism else 0)
+    factors = [mechanisms] * mechanisms
+    if not private:
+        factors[-1] = mechanisms / 2
+
+    writer = _Writer()
+    writer.open('int {}(float epsilon, int size, float q[], float T)'.format(name))
+    writer.emit('"{};";'.format(adjacency), '"epsilon: <0, 0>; size: <0, 0>; q: <*, *>; T: <0, 0>";',
+                'float out = 0;')
+    writer.emit(*('float v_{} = 0;'.format(index) for index in range(variables)))
+
+    factor = factors[0]
+    if mechanism == 'sparsevector':
+        writer.emit('float eta_T = Lap({} / epsilon, "ALIGNED; 1;");'.format(_scale(2 * factor)),
+                    'float T_bar = T + eta_T;', 'float count = 0;', 'int i = 0;')
+        writer.open('while (count < 1 && i < size)')
+        _loop_body(writer, loops, variables)
+        writer.emit('float eta_q = Lap({} / epsilon, "ALIGNED; (q[i] + eta_q >= T_bar) ? 2 : 0;");'
+                    .format(_scale(4 * factor)))
+        writer.open('if (q[i] + eta_q >= T_bar)')
+        writer.emit('out = 1;', 'count = count + 1;')
+        _branches(writer, depth, variables, statements, 'i')
+        writer.close()
+        writer.open('else')
+        writer.emit('out = 0;')
+        writer.close()
+        writer.emit('i = i + 1;')
+        writer.close()
+    elif mechanism == 'noisymax':
+        writer.emit('int max = 0;', 'float bq = 0;', 'int i = 0;')
+        writer.open('while (i < size)')
+        _loop_body(writer, loops, variables)
+        writer.emit('float eta_q = Lap({} / epsilon, "(q[i] + eta_q > bq || i == 0) ? SHADOW : ALIGNED; '
+                    '(q[i] + eta_q > bq || i == 0) ? 2 : 0;");'.format(_scale(2 * factor)))
+        writer.open('if (q[i] + eta_q > bq || i == 0)')
+        writer.emit('max = i;', 'bq = q[i] + eta_q;')
+        _branches(writer, depth, variables, statements, 'i')
+        writer.close()
+        writer.emit('i = i + 1;')
+        writer.close()
+        writer.emit('out = max;')
+
+    # chained noisy sums, the sensitivity of each sum is the number of queries if all differ, otherwise 1. They come
+    # after the mechanism since switching to the shadow execution (in noisymax) would lose their alignments
+    sensitivity = queries if adjacency == 'ALL_DIFFER' else 1
+    previous = None
+    for sample in range(1, samples + 1):
+        writer.emit('float s_{} = 0;'.format(sample), 's_{} = {};'.format(sample, ' + '.join(
+            ([previous] if previous else []) + ['q[{}]'.format(index) for index in range(queries)])))
+        distance = ' + '.join('__SHADOWDP_ALIGNED_DISTANCE_q[{}]'.format(index) for index in range(queries))
+        writer.emit('float eta_{0} = Lap({1} / epsilon, "ALIGNED; -({2});");'
+                    .format(sample, _scale(sensitivity * factors[sample - (0 if mechanism else 1)]), distance))
+        writer.emit('float r_{0} = s_{0} + eta_{0};'.format(sample))
+        previous = 'r_{}'.format(sample)
+    # release all the noisy values
+    if previous:
+        writer.emit('out = {};'.format('out + ' + previous if mechanism else previous))
+    writer.emit('return out;')
+    writer.close()
+    # the costs are linear in epsilon, so the verdict doesn't depend on its value, fix it to avoid non-linearity
+    return Program(name, '\n'.join(writer.lines) + '\n', '1', None, private)
+
+
+def generate_suite(directory, count, seed=0):
+    """ generate count programs of random sizes (half of which are private) to directory, together with a manifest
+    (see shadowdp.batch.parse_manifest) with the expected verdicts in comments.
+    :return: list of Program.
+    """
+    rand = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    programs = []
+    with open(os.path.join(directory, 'manifest.txt'), 'w') as manifest:
+        for index in range(count):
+            variables = rand.randint(0, 4)
+            statements = rand.randint(0, 4) if variables else 0
+            program = generate(name='generated_{}'.format(index), queries=rand.randint(1, 4),
+                               samples=rand.randint(0, 3), mechanism=rand.choice(MECHANISMS[:2]),
+                               depth=rand.randint(1, 3) if statements else 1, loops=rand.randint(1, 2),
+                               variables=variables, statements=statements, adjacency=rand.choice(ADJACENCIES),
+                               private=index % 2 == 0)
+            with open(os.path.join(directory, program.name + '.c'), 'w') as f:
+                f.write(program.source)
+            manifest.write('# expected: {}\n'.format('verified' if program.verdict else 'not verified'))
+            manifest.write('{}.c -e {}\n'.format(program.name, program.epsilon))
+            programs.append(program)
+    return programs
+
+
+def main(argv=sys.argv[1:]):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('directory', metavar='OUTDIR', type=str)
+    arg_parser.add_argument('-n', '--count', action='store', dest='count', type=int, default=10,
+                            help='The number of programs to generate.', required=False)
+    arg_parser.add_argument('-s', '--seed', action='store', dest='seed', type=int, default=0,
+                            help='The random seed.', required=False)
+    results = arg_parser.parse_args(argv)
+    generate_suite(results.directory, results.count, results.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
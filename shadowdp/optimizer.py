@@ -0,0 +1,333 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+""" Optional optimization pass over the transformed program, which removes the instrumentation the verifier would
+otherwise have to reason about. Only statements without side effects are removed or moved, and the calls of havoc
+(the nondeterministic values) are kept in order, so the reachability of the assertions is unchanged:
+- constant folding of e + 0, e - 0, e * 1 and 1 * e (0 + e) with integer literals;
+- assume hoisting: the assumes both branches of an if statement start with are moved before it;
+- redundant assume / store elimination: an assume (or a block of assumes, see ONE_DIFFER) is removed if the same
+  assume is already in effect, and an assignment of a constant is removed if the variable already holds it;
+- dead store elimination: self-assignments, and the distance variables which are never read (e.g., the shadow
+  distances if shadow execution is not used) with all their assignments and declarations.
+"""
+import re
+import logging
+from collections import OrderedDict
+from pycparser import c_ast
+from pycparser.c_generator import CGenerator
+logger = logging.getLogger(__name__)
+
+_generator = CGenerator()
+_DISTANCE_VARIABLE = re.compile(r'^__SHADOWDP_(ALIGNED|SHADOW)_DISTANCE_')
+_WRITES = ('++', '--', 'p++', 'p--', '&')
+
+
+def _nodes(node):
+    """ iterate over the node and all its descendants """
+    yield node
+    for _, child in node.children():
+        # the inserted declarations have empty lists as bit sizes
+        if isinstance(child, c_ast.Node):
+            yield from _nodes(child)
+
+
+def _base_name(node):
+    """ return the name of the variable an lvalue writes to, None if unknown (e.g., pointer dereference) """
+    while isinstance(node, (c_ast.ArrayRef, c_ast.StructRef)):
+        node = node.name
+    return node.name if isinstance(node, c_ast.ID) else None
+
+
+def _is_pure(node):
+    """ check if evaluating the expression has no side effects, i.e., no function calls, assignments, increments or
+    decrements """
+    return node is None or not any(
+        isinstance(child, (c_ast.FuncCall, c_ast.Assignment)) or
+        (isinstance(child, c_ast.UnaryOp) and child.op in _WRITES[:-1]) for child in _nodes(node))
+
+
+def _read_names(node):
+    return frozenset(child.name for child in _nodes(node) if isinstance(child, c_ast.ID))
+
+
+def _written_names(node):
+    """ return the names of the variables the statement might write to, None in the names means unknown variables """
+    names = set()
+    for child in _nodes(node):
+        if isinstance(child, c_ast.Assignment):
+            names.add(_base_name(child.lvalue))
+        elif isinstance(child, c_ast.UnaryOp) and child.op in _WRITES:
+            names.add(_base_name(child.expr))
+        elif isinstance(child, c_ast.Decl):
+            names.add(child.name)
+    return names
+
+
+def _is_literal(node, value):
+    return isinstance(node, c_ast.Constant) and node.type == 'int' and node.value == value
+
+
+def _fold(node):
+    """ fold the additions of 0 and the multiplications by 1 in the node and its descendants, note that e + 0 is e
+    for floating point numbers except -0.0, which compares equal to 0.0 """
+    for slot in node.__slots__:
+        if slot in ('coord', '__weakref__'):
+            continue
+        value = getattr(node, slot)
+        if isinstance(value, c_ast.Node):
+            setattr(node, slot, _fold(value))
+        elif isinstance(value, list):
+            value[:] = [_fold(item) if isinstance(item, c_ast.Node) else item for item in value]
+    if isinstance(node, c_ast.BinaryOp):
+        if (node.op in ('+', '-') and _is_literal(node.right, '0')) or \
+                (node.op == '*' and _is_literal(node.right, '1')):
+            return node.left
+        if (node.op == '+' and _is_literal(node.left, '0')) or (node.op == '*' and _is_literal(node.left, '1')):
+            return node.right
+    return node
+
+
+class _State:
+    """ the facts holding before a statement: the assumes in effect (code -> names of the variables they read) and the
+    constants the variables hold (name -> constant code) """
+    __slots__ = ('assumes', 'constants')
+
+    def __init__(self, assumes=None, constants=None):
+        self.assumes = assumes if assumes else OrderedDict()
+        self.constants = constants if constants else {}
+
+    def copy(self):
+        return _State(OrderedDict(self.assumes), dict(self.constants))
+
+    def clear(self):
+        self.assumes.clear()
+        self.constants.clear()
+
+    def kill(self, names):
+        """ forget the facts about the given variables since they are written to """
+        if None in names:
+            self.clear()
+            return
+        for code in [code for code, read in self.assumes.items() if not read.isdisjoint(names)]:
+            del self.assumes[code]
+        for name in names:
+            self.constants.pop(name, None)
+
+    def meet(self, other):
+        """ keep the facts holding in both states, i.e., after the branches of an if statement """
+        self.assumes = OrderedDict((code, read) for code, read in self.assumes.items() if code in other.assumes)
+        self.constants = {name: value for name, value in self.constants.items() if other.constants.get(name) == value}
+
+
+class _Optimizer:
+    def __init__(self, function_map):
+        self._assume = function_map['assume']
+        # calls which have no effects on the variables of the program
+        self._known_calls = {function_map['assume'], function_map['assert'], function_map['havoc']}
+        self.statistics = OrderedDict((name, 0) for name in ('hoisted_assumes', 'redundant_assumes',
+                                                             'redundant_stores', 'dead_stores'))
+
+    def _is_assume(self, node):
+        """ check if the statement is an assume function call or an if statement with only assumes in its branches
+        (e.g., the assumes on the query variable in ONE_DIFFER mode), whose conditions have no side effects """
+        if isinstance(node, c_ast.FuncCall):
+            return isinstance(node.name, c_ast.ID) and node.name.name == self._assume and _is_pure(node.args)
+        if isinstance(node, c_ast.If) and _is_pure(node.cond):
+            return all(isinstance(branch, c_ast.Compound) and
+                       all(self._is_assume(item) and isinstance(item, c_ast.FuncCall)
+                           for item in branch.block_items or ())
+                       for branch in (node.iftrue, node.iffalse) if branch is not None)
+        return False
+
+    def _effects(self, node, state):
+        """ update the state with the effects of evaluating the node """
+        if any(isinstance(child, c_ast.FuncCall) and not (isinstance(child.name, c_ast.ID) and
+                                                          child.name.name in self._known_calls)
+               for child in _nodes(node)):
+            # unknown functions might modify any variables
+            state.clear()
+        else:
+            state.kill(_written_names(node))
+
+    def _branch(self, node, state):
+        """ optimize the branch (or body) of a statement, return the optimized one """
+        if isinstance(node, c_ast.Compound):
+            node.block_items = self._block(node.block_items or [], state)
+            return node
+        statements = self._statement(node, state)
+        return statements[0] if len(statements) == 1 else c_ast.Compound(block_items=statements)
+
+    def _block(self, items, state):
+        statements = []
+        for item in items:
+            statements.extend(self._statement(item, state))
+        return statements
+
+    def _hoist(self, node):
+        """ remove the common assumes both branches start with and return them """
+        if not (isinstance(node.iftrue, c_ast.Compound) and isinstance(node.iffalse, c_ast.Compound) and
+                _is_pure(node.cond)):
+            return []
+        true_items, false_items = node.iftrue.block_items or [], node.iffalse.block_items or []
+        count = 0
+        while count < min(len(true_items), len(false_items)) and self._is_assume(true_items[count]) and \
+                _generator.visit(true_items[count]) == _generator.visit(false_items[count]):
+            count += 1
+        hoisted = true_items[:count]
+        node.iftrue.block_items, node.iffalse.block_items = true_items[count:], false_items[count:]
+        self.statistics['hoisted_assumes'] += count
+        return hoisted
+
+    def _statement(self, node, state):
+        """ optimize the statement given the facts holding before it (which are updated to the facts after it), return
+        the list of statements to replace it with """
+        if self._is_assume(node):
+            code = _generator.visit(node)
+            if code in state.assumes:
+                self.statistics['redundant_assumes'] += 1
+                return []
+            state.assumes[code] = _read_names(node)
+            return [node]
+        elif isinstance(node, c_ast.Assignment):
+            name = _base_name(node.lvalue)
+            if node.op == '=' and isinstance(node.lvalue, c_ast.ID):
+                if isinstance(node.rvalue, c_ast.ID) and node.rvalue.name == name:
+                    self.statistics['dead_stores'] += 1
+                    return []
+                if isinstance(node.rvalue, c_ast.Constant) and \
+                        state.constants.get(name) == (node.rvalue.type, node.rvalue.value):
+                    self.statistics['redundant_stores'] += 1
+                    return []
+            self._effects(node, state)
+            if node.op == '=' and isinstance(node.lvalue, c_ast.ID) and isinstance(node.rvalue, c_ast.Constant):
+                state.constants[name] = (node.rvalue.type, node.rvalue.value)
+            return [node]
+        elif isinstance(node, c_ast.Decl):
+            self._effects(node, state)
+            if isinstance(node.type, c_ast.TypeDecl) and isinstance(node.init, c_ast.Constant):
+                state.constants[node.name] = (node.init.type, node.init.value)
+            return [node]
+        elif isinstance(node, c_ast.If):
+            hoisted = self._block(self._hoist(node), state)
+            self._effects(node.cond, state)
+            false_state = state.copy()
+            node.iftrue = self._branch(node.iftrue, state)
+            if node.iffalse is not None:
+                node.iffalse = self._branch(node.iffalse, false_state)
+            state.meet(false_state)
+            return hoisted + [node]
+        elif isinstance(node, c_ast.While):
+            # the facts holding in every iteration (and after the loop) are the ones not affected by the loop
+            self._effects(node, state)
+            node.stmt = self._branch(node.stmt, state.copy())
+            return [node]
+        elif isinstance(node, c_ast.Compound):
+            node.block_items = self._block(node.block_items or [], state)
+            return [node]
+        elif isinstance(node, c_ast.Return) or (isinstance(node, c_ast.FuncCall) and _is_pure(node.args) and
+                                                isinstance(node.name, c_ast.ID) and
+                                                node.name.name in self._known_calls):
+            return [node]
+        # other statements (e.g., function calls, switch or for statements) are kept as is without any assumptions
+        state.clear()
+        return [node]
+
+    def _remove_dead_stores(self, function):
+        """ remove the distance variables which are never read, along with their assignments and declarations """
+        stores, reads, writes = {}, set(), set()
+
+        def is_store(item):
+            if isinstance(item, c_ast.Assignment):
+                return item.op == '=' and isinstance(item.lvalue, c_ast.ID) and _is_pure(item.rvalue) and \
+                       _DISTANCE_VARIABLE.match(item.lvalue.name)
+            return isinstance(item, c_ast.Decl) and isinstance(item.type, c_ast.TypeDecl) and \
+                _is_pure(item.init) and _DISTANCE_VARIABLE.match(item.name)
+
+        def collect(node):
+            if isinstance(node, c_ast.Compound):
+                for item in node.block_items or ():
+                    if is_store(item):
+                        name = item.name if isinstance(item, c_ast.Decl) else item.lvalue.name
+                        stores.setdefault(name, []).append(item.init if isinstance(item, c_ast.Decl) else item.rvalue)
+                    else:
+                        collect(item)
+                return
+            if isinstance(node, c_ast.ID):
+                reads.add(node.name)
+            elif isinstance(node, c_ast.Decl):
+                writes.add(node.name)
+            for _, child in node.children():
+                if isinstance(child, c_ast.Node):
+                    collect(child)
+
+        collect(function.body)
+        # the variables read (or declared) by the other statements are live, and so are the variables their stores read
+        live = reads | writes
+        pending = list(live)
+        while pending:
+            for value in stores.get(pending.pop(), ()):
+                for name in _read_names(value) if value is not None else ():
+                    if name not in live:
+                        live.add(name)
+                        pending.append(name)
+        dead = set(stores) - live
+        if not dead:
+            return
+
+        def remove(node):
+            for child in _nodes(node):
+                if isinstance(child, c_ast.Compound) and child.block_items:
+                    items = [item for item in child.block_items if not (is_store(item) and (
+                        item.name if isinstance(item, c_ast.Decl) else item.lvalue.name) in dead)]
+                    self.statistics['dead_stores'] += len(child.block_items) - len(items)
+                    child.block_items = items
+
+        remove(function.body)
+
+    def optimize(self, function):
+        _fold(function.body)
+        # the structured analysis doesn't apply to the jumps
+        if not any(isinstance(node, (c_ast.Goto, c_ast.Label)) for node in _nodes(function.body)):
+            self._branch(function.body, _State())
+        self._remove_dead_stores(function)
+
+
+def optimize(ast, function_map):
+    """ optimize the transformed functions in place for the verifier, see the module documentation for the passes.
+    :param ast: The transformed c_ast.FileAST, or a c_ast.FuncDef.
+    :param function_map: The mapping from assert / assume / havoc to the actual functions, see ShadowDPTransformer.
+    :return: OrderedDict of the number of statements hoisted / removed by each pass.
+    """
+    statistics = None
+    for function in ([ast] if isinstance(ast, c_ast.FuncDef) else
+                     [node for node in ast.ext if isinstance(node, c_ast.FuncDef)]):
+        optimizer = _Optimizer(function_map)
+        optimizer.optimize(function)
+        logger.info('Optimized function {}: {}'.format(
+            function.decl.name, ', '.join('{} {}'.format(count, name.replace('_', ' '))
+                                          for name, count in optimizer.statistics.items())))
+        if statistics is None:
+            statistics = optimizer.statistics
+        else:
+            for name, count in optimizer.statistics.items():
+                statistics[name] += count
+    return statistics if statistics is not None else _Optimizer(function_map).statistics
@@ -0,0 +1,189 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+import os
+import time
+import tracemalloc
+
+# the profile being recorded, None if profiling is off
+_profile = None
+# whether start() began tracing the memory allocations, so stop() doesn't stop the tracing of others
+_is_tracing_started = False
+
+
+class Profile:
+    """ Time and peak traced (Python) memory of each phase, counters of events (e.g., fast path hits), the iterations
+    and time of the fixed point of each loop, and the wall time and peak RSS of each solver. Phases can be nested, in
+    which case the time of the inner phases is included in the outer ones. Peak memory of a phase is only accurate on
+    Python 3.9+, where tracemalloc's peak can be reset, older versions report the peak since profiling started."""
+    def __init__(self):
+        self.start = time.time()
+        self.phases = OrderedDict()
+        self.solvers = OrderedDict()
+        self.counters = OrderedDict()
+        self.loops = OrderedDict()
+        # open phases, each being [name, peak traced memory so far]
+        self._stack = []
+
+    def _update_peak(self):
+        _, peak = tracemalloc.get_traced_memory()
+        for frame in self._stack:
+            frame[1] = max(frame[1], peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def enter(self, name):
+        self._update_peak()
+        self._stack.append([name, 0])
+        return time.time()
+
+    def exit(self, start):
+        seconds = time.time() - start
+        self._update_peak()
+        name, peak = self._stack.pop()
+        phase = self.phases.setdefault(name, OrderedDict((('calls', 0), ('seconds', 0), ('peak_python_bytes', 0))))
+        phase['calls'] += 1
+        phase['seconds'] += seconds
+        phase['peak_python_bytes'] = max(phase['peak_python_bytes'], peak)
+
+    def report(self):
+        _, peak = tracemalloc.get_traced_memory()
+        return OrderedDict((
+            ('seconds', time.time() - self.start),
+            ('peak_python_bytes', max([peak] + [phase['peak_python_bytes'] for phase in self.phases.values()])),
+            ('phases', self.phases),
+            ('counters', self.counters),
+            ('loops', self.loops),
+            ('solvers', self.solvers)
+        ))
+
+
+def start():
+    """ start recording a new profile, tracing memory allocations from now on."""
+    global _profile, _is_tracing_started
+    _profile = Profile()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _is_tracing_started = True
+
+
+def stop():
+    """ stop recording the profile.
+    :return: The report of the profile in a JSON-serializable dict, None if profiling is off.
+    """
+    global _profile, _is_tracing_started
+    if _profile is None:
+        return None
+    report = _profile.report()
+    _profile = None
+    if _is_tracing_started:
+        tracemalloc.stop()
+        _is_tracing_started = False
+    return report
+
+
+def is_enabled():
+    return _profile is not None
+
+
+@contextmanager
+def phase(name):
+    """ record the time and peak memory of the with block as the phase name, does nothing if profiling is off."""
+    if _profile is None:
+        yield
+        return
+    profile = _profile
+    start_time = profile.enter(name)
+    try:
+        yield
+    finally:
+        profile.exit(start_time)
+
+
+def profiled(name):
+    """ decorator to record each call of the function as the phase name."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return func(*args, **kwargs)
+            profile = _profile
+            start_time = profile.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.exit(start_time)
+        return wrapper
+    return decorator
+
+
+def count(name):
+    """ increase the counter name by one, e.g., to report the hit rates of the fast paths."""
+    if _profile is not None:
+        _profile.counters[name] = _profile.counters.get(name, 0) + 1
+
+
+def record_loop(name, iterations, seconds):
+    """ record a fixed point computation of the loop name (e.g., function:line), the runs of a loop (e.g., an inner
+    loop runs once per iteration of the outer one) are summed up."""
+    if _profile is not None:
+        loop = _profile.loops.setdefault(name, OrderedDict((('runs', 0), ('iterations', 0), ('seconds', 0))))
+        loop['runs'] += 1
+        loop['iterations'] += iterations
+        loop['seconds'] += seconds
+
+
+def record_solver(name, outcome, seconds, peak_rss_bytes):
+    """ record the outcome, wall time and peak resident memory of a solver run."""
+    if _profile is not None:
+        _profile.solvers[name] = OrderedDict((('outcome', outcome), ('seconds', seconds),
+                                              ('peak_rss_bytes', peak_rss_bytes)))
+
+
+def _descendants(pid):
+    children = []
+    try:
+        for task in os.listdir('/proc/{}/task'.format(pid)):
+            with open('/proc/{}/task/{}/children'.format(pid, task)) as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        # already exited, or the kernel doesn't expose the children
+        pass
+    return children + [descendant for child in children for descendant in _descendants(child)]
+
+
+def peak_rss(pid):
+    """ return the total peak resident set size (VmHWM) in bytes of the process and its descendants, e.g., cpa.sh
+    and the JVM it starts, 0 if not available (e.g., not on Linux)."""
+    total = 0
+    for process in [pid] + _descendants(pid):
+        try:
+            with open('/proc/{}/status'.format(process)) as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
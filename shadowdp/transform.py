@@ -0,0 +1,231 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import re
+import subprocess
+import sys
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import pycparser
+from pycparser import c_ast
+from pycparser.c_generator import CGenerator
+from shadowdp.core import ShadowDPTransformer
+from shadowdp.cache import DiskCache
+from shadowdp.optimizer import optimize as optimize_function
+from shadowdp.typesystem import get_parser
+from shadowdp.exceptions import *
+from shadowdp import profiler
+from shadowdp.profiler import phase
+logger = logging.getLogger(__name__)
+
+HEADER = r"""extern void __VERIFIER_error() __attribute__ ((__noreturn__));
+extern int __VERIFIER_nondet_float(void);
+extern int __VERIFIER_nondet_int();
+extern void __VERIFIER_assume(int);
+extern void __assert_fail();
+#define __VERIFIER_assert(cond) { if(!(cond)) { __assert_fail(); } }
+#define Abs(x) ((x) < 0 ? -(x) : (x))
+typedef enum { false = 0, true = 1 } bool;
+    
+"""
+
+FUNCTION_MAP = {
+    'assert': '__VERIFIER_assert',
+    'assume': '__VERIFIER_assume',
+    'havoc': '__VERIFIER_nondet_float'
+}
+
+
+def _transform_function(node, epsilon, goal, use_cache, optimize):
+    """ transform (and optimize) a function definition with its own transformer, run in the worker processes for
+    multi-function files, so the functions share no state.
+    :return: The transformed function definition.
+    """
+    ShadowDPTransformer(function_map=FUNCTION_MAP, set_epsilon=epsilon, set_goal=goal,
+                        query_cache=DiskCache('z3') if use_cache else None).visit(node)
+    if optimize:
+        with phase('optimize'):
+            optimize_function(node, FUNCTION_MAP)
+    return node
+
+
+# the sources without directives, comments or line continuations can be parsed without the preprocessor
+_NEEDS_CPP = re.compile(r'^\s*#|/[*/]|\\$', re.MULTILINE)
+_INCLUDE = re.compile(r'^\s*#\s*include', re.MULTILINE)
+
+
+def _preprocess(text, path, cpp_path, cpp_args):
+    """ run the preprocessor on the source file, or on the source code passed in stdin if path is None."""
+    try:
+        return subprocess.run([cpp_path, *cpp_args, path if path else '-'], input=None if path else text,
+                              stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        # the same error as pycparser.preprocess_file
+        raise RuntimeError('Unable to invoke \'{}\'. Make sure its path was passed correctly\n'
+                           'Original error: {}'.format(cpp_path, e))
+
+
+def _parse(text, path, cpp_path, cpp_args, use_cache):
+    """ preprocess (if needed) and parse the source code, the parsed ASTs are cached on disk. The key is the source
+    code with the preprocessor and its arguments, or the preprocessed code if the source includes other files since
+    they might change."""
+    filename = path if path else '<stdin>'
+    needs_cpp = _NEEDS_CPP.search(text) is not None
+    with phase('parse'):
+        if needs_cpp and _INCLUDE.search(text):
+            text, needs_cpp = _preprocess(text, path, cpp_path, cpp_args), False
+        cache, key = None, None
+        if use_cache:
+            cache = DiskCache('ast')
+            key = DiskCache.key(text, filename, pycparser.__version__, *((cpp_path, *cpp_args) if needs_cpp else ()))
+            ast = cache.get(key)
+            if ast is not None:
+                profiler.count('ast_cache_hit')
+                return ast
+        ast = get_parser().parse(_preprocess(text, path, cpp_path, cpp_args) if needs_cpp else text, filename)
+        if cache:
+            cache.set(key, ast)
+        return ast
+
+
+def parse_source(text, cpp_path='gcc', cpp_args=('-E', ), use_cache=True):
+    """ parse the source code in memory, the source is piped through the preprocessor only if it needs to, i.e., it
+    has directives or comments.
+    :param text: The source code in str.
+    :param cpp_path: The path of the preprocessor.
+    :param cpp_args: The arguments of the preprocessor, the source is passed in stdin.
+    :param use_cache: Whether to use the on-disk cache of the parsed sources.
+    :return: The c_ast.FileAST of the source.
+    """
+    return _parse(text, None, cpp_path, cpp_args, use_cache)
+
+
+def parse_path(path, cpp_path='gcc', cpp_args=('-E', ), use_cache=True):
+    """ parse the source file like pycparser.parse_file(path, use_cpp=True, ...), the preprocessor only runs if the
+    source needs it, and the parsed source is reused from the on-disk cache if it hasn't changed.
+    :param path: The path of the source file.
+    :param cpp_path: The path of the preprocessor.
+    :param cpp_args: The arguments of the preprocessor.
+    :param use_cache: Whether to use the on-disk cache of the parsed sources.
+    :return: The c_ast.FileAST of the source.
+    """
+    with open(path) as f:
+        return _parse(f.read(), path, cpp_path, cpp_args, use_cache)
+
+
+def transform_ast(ast, epsilon=None, goal=None, jobs=None, use_cache=True, optimize=False):
+    """ transform the parsed source in place, each function is transformed by its own transformer.
+    :param ast: The c_ast.FileAST of the source, e.g., from parse_source.
+    :param epsilon: Set epsilon to a specific value to solve the non-linear issues.
+    :param goal: The goal of the algorithm, e.g., 2 means to verify 2 * epsilon-differential privacy.
+    :param jobs: The number of worker processes to transform the functions of a multi-function source in, default is
+    the number of cores, 1 (or a single function) means transforming in this process.
+    :param use_cache: Whether to use the on-disk cache of the z3 query results.
+    :param optimize: Whether to run the optimization pass (see shadowdp.optimizer) over the transformed functions.
+    :return: The transformed c_ast.FileAST (i.e., ast), the errors of the annotations (see shadowdp.exceptions)
+    are raised.
+    """
+    functions = [index for index, node in enumerate(ast.ext) if isinstance(node, c_ast.FuncDef)]
+    with phase('transform'):
+        if len(functions) <= 1 or jobs == 1:
+            for index in functions:
+                _transform_function(ast.ext[index], epsilon, goal, use_cache, optimize)
+        else:
+            logger.info('Transforming {} functions in parallel'.format(len(functions)))
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(_transform_function, ast.ext[index], epsilon, goal, use_cache, optimize)
+                           for index in functions]
+                for index, future in zip(functions, futures):
+                    ast.ext[index] = future.result()
+    return ast
+
+
+def generate_code(ast):
+    """ return the code of the transformed source with the verifier headers."""
+    with phase('emit'):
+        return HEADER + CGenerator().visit(ast)
+
+
+def transform_source(text, epsilon=None, goal=None, jobs=None, use_cache=True, optimize=False):
+    """ transform the source code in memory, without any temporary files.
+    :param text: The source code in str.
+    :param epsilon: Set epsilon to a specific value to solve the non-linear issues.
+    :param goal: The goal of the algorithm, e.g., 2 means to verify 2 * epsilon-differential privacy.
+    :param jobs: The number of worker processes for multi-function sources, see transform_ast.
+    :param use_cache: Whether to use the on-disk caches of the parsed sources and the z3 query results.
+    :param optimize: Whether to optimize the transformed code for the verifier.
+    :return: The transformed code (with verifier headers) in str, the errors of the annotations (see
+    shadowdp.exceptions) are raised.
+    """
+    return generate_code(transform_ast(parse_source(text, use_cache=use_cache), epsilon, goal, jobs, use_cache,
+                                       optimize))
+
+
+def transform(path, out, epsilon=None, goal=None, jobs=None, use_cache=True, optimize=False):
+    """ parse and transform the source file, then write the transformed code (with verifier headers) to out.
+    :param path: The path of the source file, - for stdin.
+    :param out: The path of the output file, - for stdout.
+    :param epsilon: Set epsilon to a specific value to solve the non-linear issues.
+    :param goal: The goal of the algorithm, e.g., 2 means to verify 2 * epsilon-differential privacy.
+    :param jobs: The number of worker processes to transform the functions of a multi-function file in, default is
+    the number of cores, 1 (or a single function) means transforming in this process.
+    :param use_cache: Whether to use the on-disk caches of the parsed sources and the z3 query results.
+    :param optimize: Whether to optimize the transformed code for the verifier.
+    :return: Boolean indicating if the transformation succeeded, errors are logged.
+    """
+    # parse the source code
+    logger.info('Parsing {}'.format(path))
+    start = time.time()
+    if path == '-':
+        ast = parse_source(sys.stdin.read(), use_cache=use_cache)
+    else:
+        ast = parse_path(path, use_cache=use_cache)
+
+    try:
+        transform_ast(ast, epsilon, goal, jobs, use_cache, optimize)
+    except NoParameterAnnotationError as e:
+        logger.error('{} First statements must be a string containing annotation'.format(str(e.coord)))
+        return False
+    except NoSamplingAnnotationError as e:
+        logger.error('{} Sampling command lack annotation'.format(str(e.coord)))
+        return False
+    except ReturnDistanceNotZero as e:
+        logger.error('{}: Aligned distance of return variable {} is not zero ({})'
+                     .format(str(e.coord), e.name, e.distance))
+        return False
+    except SamplingCommandMisplaceError as e:
+        logger.error('{}: Cannot use sampling command in diverging branch.'.format(e.coord))
+        return False
+    except SamplingCommandInjectivityError as e:
+        logger.error('{}: Distance annotation {} for {} isn\'t injective'.format(e.coord, e.eta, e.annotation))
+        return False
+
+    # write the transformed code
+    code = generate_code(ast)
+    if out == '-':
+        sys.stdout.write(code)
+    else:
+        with open(out, 'w') as f:
+            f.write(code)
+
+    logger.info('Transformation finished in {0:.3f} seconds'.format(time.time() - start))
+    return True
@@ -19,83 +19,500 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import copy
+import re
+import weakref
 from collections import OrderedDict
-from pycparser.c_parser import CParser
+from functools import lru_cache
+from pycparser.c_lexer import CLexer
 from pycparser.c_generator import CGenerator
-from pycparser.c_ast import NodeVisitor
 from pycparser import c_ast
+from shadowdp import profiler
+from shadowdp.profiler import profiled
 
 
-_parser = CParser()
 _generator = CGenerator()
 
 
+@lru_cache(maxsize=None)
+def get_parser():
+    """ return the shared C parser, which is built on first use since building it (from the parser tables shipped
+    with pycparser) is slow and isn't needed by all commands, the parser can be reused for any number of sources. """
+    from pycparser.c_parser import CParser
+    return CParser()
+
+
+# the number of expressions (cache misses) simplified by each path of _simplify, see simplify_stats
+_simplify_stats = OrderedDict((('unchanged', 0), ('linear', 0), ('sympy', 0)))
+
+
+class _LinearParseError(Exception):
+    pass
+
+
+class _LinearParser:
+    """ A parser of the linear expressions with integer coefficients over the distance variables (__SHADOWDP_*),
+    which are most of the distances, e.g., __SHADOWDP_ALIGNED_DISTANCE_x + 1. The expression is parsed into the
+    coefficients of the variables and the constant (None), anything else (e.g., non-linear terms, floats or other
+    variables, which sympy may treat as its own functions or constants) raises _LinearParseError."""
+    _TOKEN = re.compile(r'\s*(?:(?P<int>(?:0|[1-9][0-9]*)(?![.\w]))|(?P<id>__SHADOWDP_\w*)|(?P<op>[-+*()]))')
+
+    def __init__(self, expression):
+        self._tokens = []
+        position, expression = 0, expression.rstrip()
+        while position < len(expression):
+            match = self._TOKEN.match(expression, position)
+            if not match:
+                raise _LinearParseError(expression)
+            self._tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        self._tokens.append((None, None))
+        self._index = 0
+
+    def _next(self):
+        token = self._tokens[self._index]
+        self._index += 1
+        return token
+
+    def parse(self):
+        coefficients = self._expression()
+        if self._tokens[self._index][0] is not None:
+            raise _LinearParseError(self._tokens[self._index][1])
+        return coefficients
+
+    @staticmethod
+    def _add(left, right, sign):
+        for name, coefficient in right.items():
+            left[name] = left.get(name, 0) + sign * coefficient
+        return left
+
+    def _expression(self):
+        coefficients = self._term()
+        while self._tokens[self._index][1] in ('+', '-'):
+            _, op = self._next()
+            coefficients = self._add(coefficients, self._term(), 1 if op == '+' else -1)
+        return coefficients
+
+    def _term(self):
+        coefficients = self._unary()
+        while self._tokens[self._index][1] == '*':
+            self._next()
+            right = self._unary()
+            # only the products with a constant are linear
+            constant, other = (coefficients, right) if set(coefficients) <= {None} else (right, coefficients)
+            if not set(constant) <= {None}:
+                raise _LinearParseError('*')
+            coefficients = {name: coefficient * constant.get(None, 0) for name, coefficient in other.items()}
+        return coefficients
+
+    def _unary(self):
+        if self._tokens[self._index][1] in ('+', '-'):
+            _, op = self._next()
+            return {name: -coefficient for name, coefficient in self._unary().items()} if op == '-' \
+                else self._unary()
+        kind, value = self._next()
+        if kind == 'int':
+            return {None: int(value)}
+        elif kind == 'id':
+            return {value: 1}
+        elif value == '(':
+            coefficients = self._expression()
+            if self._next()[1] != ')':
+                raise _LinearParseError(value)
+            return coefficients
+        raise _LinearParseError(value)
+
+
+def _format_linear(coefficients):
+    """ format the coefficients in the same way as str(sympy.simplify(expression)) does, i.e., the variables sorted
+    by their names followed by the constant, except that a positive constant goes first if the only other term is
+    negative, see Expr.as_ordered_terms of sympy.
+    >>> _format_linear({'__SHADOWDP_b': -1, '__SHADOWDP_a': 2, None: 1})
+    '2*__SHADOWDP_a - __SHADOWDP_b + 1'
+    >>> _format_linear({'__SHADOWDP_a': -1, None: 1})
+    '1 - __SHADOWDP_a'
+    >>> _format_linear({'__SHADOWDP_a': 1, None: -1, '__SHADOWDP_b': 0})
+    '__SHADOWDP_a - 1'
+    """
+    terms = sorted((name, coefficient) for name, coefficient in coefficients.items()
+                   if name is not None and coefficient != 0)
+    constant = coefficients.get(None, 0)
+    if constant != 0:
+        if len(terms) == 1 and constant > 0 and terms[0][1] < 0:
+            terms.insert(0, (None, constant))
+        else:
+            terms.append((None, constant))
+    if len(terms) == 0:
+        return '0'
+    code = []
+    for name, coefficient in terms:
+        if name is None:
+            term = str(abs(coefficient))
+        else:
+            term = name if abs(coefficient) == 1 else '{}*{}'.format(abs(coefficient), name)
+        code.append(('-' if coefficient < 0 else '') if len(code) == 0 else (' - ' if coefficient < 0 else ' + '))
+        code.append(term)
+    return ''.join(code)
+
+
+@profiled('sympy')
+def _sympy_simplify(expression):
+    from sympy import simplify
+    try:
+        return str(simplify(expression))
+    except Exception:
+        # not an expression that sympy understands (e.g., ternary operators), leave it as it is
+        return expression
+
+
+@lru_cache(maxsize=4096)
+def _simplify(expression):
+    # sympy cannot parse the star and the ternary operators, leave them as they are without calling it
+    if expression == '*' or '?' in expression:
+        _simplify_stats['unchanged'] += 1
+        profiler.count('simplify_unchanged')
+        return expression
+    try:
+        simplified = _format_linear(_LinearParser(expression).parse())
+        _simplify_stats['linear'] += 1
+        profiler.count('simplify_linear')
+        return simplified
+    except _LinearParseError:
+        pass
+    _simplify_stats['sympy'] += 1
+    profiler.count('simplify_sympy')
+    return _sympy_simplify(expression)
+
+
+def simplify_expression(expression):
+    """ simplify the expression, the linear expressions of distance variables are normalized natively, the others
+    are simplified using sympy. The results are memoized in a bounded LRU cache shared across the whole
+    transformation, since the same distances get simplified over and over again (e.g., in loops).
+    :param expression: The expression to simplify.
+    :return: The simplified expression in str, or the expression itself if it cannot be simplified.
+    """
+    # sympy treats brackets as indexing, escape them to make array elements plain symbols
+    expression = str(expression).replace('[', '__LEFTBRACE__').replace(']', '__RIGHTBRACE__')
+    return _simplify(expression).replace('__LEFTBRACE__', '[').replace('__RIGHTBRACE__', ']')
+
+
+def simplify_cache_info():
+    """ return the statistics (hits, misses, maxsize, currsize) of the simplification cache."""
+    return _simplify.cache_info()
+
+
+def simplify_stats():
+    """ return the number of expressions (cache misses) simplified by each path: unchanged (without calling sympy,
+    e.g., ternary operators), linear (the native normalizer) and sympy."""
+    return OrderedDict(_simplify_stats)
+
+
+class _ExpressionParseError(Exception):
+    pass
+
+
+class _ExpressionParser:
+    """ A lightweight precedence climbing parser for the subset of C expressions used in distances and annotations
+    (identifiers, int / double constants, array references, function calls, unary / binary / ternary operators).
+    Instead of c_ast nodes it produces "recipes", i.e., immutable nested tuples of (node class, *fields), which can
+    be safely cached and then built into fresh nodes. It produces the same trees as pycparser does, anything beyond
+    the subset raises _ExpressionParseError."""
+    _TOKEN = re.compile(r'''\s*(?:
+        (?P<float>(?:[0-9]*\.[0-9]+|[0-9]+\.)(?:[eE][-+]?[0-9]+)?(?![.\w])|[0-9]+[eE][-+]?[0-9]+(?![.\w])) |
+        (?P<int>(?:0|[1-9][0-9]*)(?![.\w])) |
+        (?P<id>[a-zA-Z_][a-zA-Z0-9_]*) |
+        (?P<op>\|\||&&|==|!=|>=|<=|<<|>>|\+\+|--|->|[-+*/%<>!~&|^?:()\[\],])
+    )''', re.VERBOSE)
+    # binary operators and their precedences, same as pycparser
+    _BINARY_OPS = {
+        '||': 1, '&&': 2, '|': 3, '^': 4, '&': 5, '==': 6, '!=': 6, '>': 7, '>=': 7, '<': 7, '<=': 7,
+        '>>': 8, '<<': 8, '+': 9, '-': 9, '*': 10, '/': 10, '%': 10
+    }
+    _UNARY_OPS = ('-', '+', '!', '~', '*', '&')
+
+    def __init__(self, expression):
+        self._tokens = []
+        position, expression = 0, expression.rstrip()
+        while position < len(expression):
+            match = self._TOKEN.match(expression, position)
+            if not match:
+                raise _ExpressionParseError(expression)
+            kind = match.lastgroup
+            value = match.group(kind)
+            if (kind == 'id' and value in CLexer.keyword_map) or value in ('++', '--', '->'):
+                raise _ExpressionParseError(value)
+            self._tokens.append((kind, value))
+            position = match.end()
+        self._tokens.append((None, None))
+        self._index = 0
+
+    def _peek(self):
+        return self._tokens[self._index]
+
+    def _next(self):
+        token = self._tokens[self._index]
+        self._index += 1
+        return token
+
+    def _expect(self, op):
+        kind, value = self._next()
+        if kind != 'op' or value != op:
+            raise _ExpressionParseError('expected {}, got {}'.format(op, value))
+
+    def parse(self):
+        recipe = self._conditional()
+        if self._peek() != (None, None):
+            raise _ExpressionParseError('unexpected token {}'.format(self._peek()[1]))
+        return recipe
+
+    def _conditional(self):
+        cond = self._binary(1)
+        if self._peek() == ('op', '?'):
+            self._next()
+            iftrue = self._conditional()
+            self._expect(':')
+            return c_ast.TernaryOp, cond, iftrue, self._conditional()
+        return cond
+
+    def _binary(self, min_precedence):
+        left = self._unary()
+        while True:
+            kind, value = self._peek()
+            if kind != 'op' or self._BINARY_OPS.get(value, 0) < min_precedence:
+                return left
+            self._next()
+            # all binary operators are left associative
+            left = c_ast.BinaryOp, value, left, self._binary(self._BINARY_OPS[value] + 1)
+
+    def _unary(self):
+        kind, value = self._peek()
+        if kind == 'op' and value in self._UNARY_OPS:
+            self._next()
+            return c_ast.UnaryOp, value, self._unary()
+        return self._postfix()
+
+    def _postfix(self):
+        recipe = self._primary()
+        while True:
+            kind, value = self._peek()
+            if (kind, value) == ('op', '['):
+                self._next()
+                subscript = self._conditional()
+                self._expect(']')
+                recipe = c_ast.ArrayRef, recipe, subscript
+            elif (kind, value) == ('op', '('):
+                self._next()
+                args = []
+                if self._peek() != ('op', ')'):
+                    args.append(self._conditional())
+                    while self._peek() == ('op', ','):
+                        self._next()
+                        args.append(self._conditional())
+                self._expect(')')
+                recipe = c_ast.FuncCall, recipe, (c_ast.ExprList, (list, *args)) if args else None
+            else:
+                return recipe
+
+    def _primary(self):
+        kind, value = self._next()
+        if kind == 'id':
+            return c_ast.ID, value
+        elif kind == 'int':
+            return c_ast.Constant, 'int', value
+        elif kind == 'float':
+            return c_ast.Constant, 'double', value
+        elif (kind, value) == ('op', '('):
+            recipe = self._conditional()
+            self._expect(')')
+            return recipe
+        raise _ExpressionParseError('unexpected token {}'.format(value))
+
+
+def _to_recipe(value):
+    """ convert c_ast node to recipe, where nodes are (node class, *fields) and lists are (list, *items)."""
+    if isinstance(value, c_ast.Node):
+        return (type(value), *(_to_recipe(getattr(value, slot)) for slot in value.__slots__
+                               if slot not in ('coord', '__weakref__')))
+    elif isinstance(value, list):
+        return (list, *(_to_recipe(item) for item in value))
+    return value
+
+
+def _build(recipe):
+    if isinstance(recipe, tuple):
+        constructor, *fields = recipe
+        return constructor(_build(field) for field in fields) if constructor is list else \
+            constructor(*(_build(field) for field in fields))
+    return recipe
+
+
+@lru_cache(maxsize=4096)
+def _parse(expression):
+    try:
+        return _ExpressionParser(expression).parse()
+    except _ExpressionParseError:
+        # this is a trick since pycparser cannot parse expression directly
+        return _to_recipe(get_parser().parse('int placeholder(){{{};}}'.format(expression)).ext[0].body.block_items[0])
+
+
 def convert_to_ast(expression):
-    # this is a trick since pycparser cannot parse expression directly
-    ast = _parser.parse('int placeholder(){{{};}}'.format(expression)).ext[0].body.block_items[0]
-    return ast
+    """ convert the expression string to c_ast node, the parsed results are cached so a fresh copy of the node is
+    returned each time, which is free to be modified.
+    :param expression: The expression in str.
+    :return: c_ast node of the expression.
+    """
+    return _build(_parse(str(expression)))
+
+
+# hash-consing table from (node class, *fields with interned children) to the canonical node
+_interned = weakref.WeakValueDictionary()
+_canonical = weakref.WeakSet()
+
+
+def intern_node(node):
+    """ return the canonical node which is structurally equal to the given node, so that structurally equal nodes
+    are represented by the same object and compared by identity. Canonical nodes are shared and must not be
+    modified, the given node is never modified nor made canonical itself.
+    :param node: The expression node.
+    :return: The canonical node.
+    """
+    if node in _canonical:
+        return node
+    fields = []
+    for slot in node.__slots__:
+        if slot in ('coord', '__weakref__'):
+            continue
+        value = getattr(node, slot)
+        if isinstance(value, c_ast.Node):
+            value = intern_node(value)
+        elif isinstance(value, list):
+            value = tuple(intern_node(item) if isinstance(item, c_ast.Node) else item for item in value)
+        fields.append(value)
+    # the children are already canonical, so hashing the key only takes O(number of children)
+    key = (type(node), *fields)
+    canonical = _interned.get(key)
+    if canonical is None:
+        canonical = type(node)(*(list(field) if isinstance(field, tuple) else field for field in fields))
+        _interned[key] = canonical
+        _canonical.add(canonical)
+    return canonical
 
 
 def is_node_equal(node_1, node_2):
     """ check if two expression AST nodes are equal since pycparser doesn't provide such property
-    :param node_1: First expression node
-    :param node_2: Second expression node
+    :param node_1: First expression node (or '*')
+    :param node_2: Second expression node (or '*')
     :return: Boolean
     """
-    # naive comparison, can be optimized
-    return node_1.__repr__() == node_2.__repr__()
+    if node_1 is node_2:
+        return True
+    if not (isinstance(node_1, c_ast.Node) and isinstance(node_2, c_ast.Node)):
+        return node_1 == node_2
+    return intern_node(node_1) is intern_node(node_2)
+
+
+@lru_cache(maxsize=4096)
+def _parse_interned(expression):
+    return intern_node(convert_to_ast(expression))
 
 
-class _DistanceSimplifier(NodeVisitor):
+@lru_cache(maxsize=4096)
+def _to_code(canonical_node):
+    # canonical nodes are immutable, so the generated code can be cached
+    return _generator.visit(canonical_node)
+
+
+@lru_cache(maxsize=4096)
+def _mentions(distance):
+    """ return the names of the identifiers in a canonical distance node, '*' mentions no identifiers."""
+    if isinstance(distance, c_ast.ID):
+        return frozenset((distance.name, ))
+    if not isinstance(distance, c_ast.Node):
+        return frozenset()
+    # the children of canonical nodes are canonical too, so the sub-results are cached as well
+    return frozenset().union(*(_mentions(child) for _, child in distance.children()))
+
+
+def clear_caches():
+    """ clear the memoized simplifications, parsed expressions and generated code, e.g., to measure the cold
+    performance of the transformation."""
+    for cached in (_simplify, _parse, _parse_interned, _to_code, _mentions):
+        cached.cache_clear()
+
+
+def _replace_children(node, replace):
+    """ return the node with its children replaced by replace(child), a new node is created only if any of the
+    children changes."""
+    changed, fields = False, []
+    for slot in node.__slots__:
+        if slot in ('coord', '__weakref__'):
+            continue
+        value = getattr(node, slot)
+        if isinstance(value, c_ast.Node):
+            new_value = replace(value)
+            changed = changed or new_value is not value
+        elif isinstance(value, list):
+            new_value = [replace(item) if isinstance(item, c_ast.Node) else item for item in value]
+            changed = changed or any(new is not old for new, old in zip(new_value, value))
+        else:
+            new_value = value
+        fields.append(new_value)
+    return type(node)(*fields) if changed else node
+
+
+class _DistanceSimplifier:
     """Simplifies a given distance c_ast node using conditions.
-    e.g. distance x + y > 0 ? 2 : 0 would be simplified to 2 if condition (x + y > 0) is given."""
+    e.g. distance x + y > 0 ? 2 : 0 would be simplified to 2 if condition (x + y > 0) is given.
+    Distances are canonical nodes, so the simplified distance is built as new nodes instead of modifying them."""
     def __init__(self, condition, is_true):
-        self._condition = condition
+        self._condition = intern_node(condition)
         self._is_true = is_true
 
     def _simplify(self, ternary_node):
         assert isinstance(ternary_node, c_ast.TernaryOp)
-        if is_node_equal(ternary_node.cond, self._condition):
+        if intern_node(ternary_node.cond) is self._condition:
             return ternary_node.iftrue if self._is_true else ternary_node.iffalse
         return ternary_node
 
-    def visit_BinaryOp(self, node):
-        node.left = self._simplify(node.left) if isinstance(node.left, c_ast.TernaryOp) else node.left
-        node.right = self._simplify(node.right) if isinstance(node.right, c_ast.TernaryOp) else node.right
-        for c in node:
-            self.visit(c)
-
-    def visit_UnaryOp(self, node):
-        node.expr = self._simplify(node.expr) if isinstance(node.expr, c_ast.TernaryOp) else node.expr
-        self.visit(node.expr)
+    def _visit(self, node):
+        if isinstance(node, (c_ast.BinaryOp, c_ast.UnaryOp)):
+            # only simplify the ternary operations which are operands of binary / unary operations
+            return _replace_children(
+                node, lambda child: self._visit(self._simplify(child) if isinstance(child, c_ast.TernaryOp) else child))
+        return _replace_children(node, self._visit)
 
     def simplify(self, node):
-        # copy a node in order not to mess with parameter
-        node = copy.copy(node)
         if isinstance(node, c_ast.TernaryOp):
             node = self._simplify(node)
-        self.visit(node)
-        return node
+        return intern_node(self._visit(node))
 
 
 class TypeSystem:
     """ TypeSystem keeps track of the distances of each variable. The distance of each variable is internally
-    represented by c_ast node, and gets simplified and casted to strings when get_distance method is called"""
+    represented by canonical (hash-consed) c_ast node, and gets simplified and casted to strings when get_distance
+    method is called"""
     _EXPR_NODES = (c_ast.BinaryOp, c_ast.TernaryOp, c_ast.UnaryOp, c_ast.ID, c_ast.Constant, c_ast.ArrayRef)
 
+    __slots__ = ('_types', '_dependents', '_positions', '_shared')
+
     def __init__(self, types=None):
-        if types:
-            self._types = types
-        else:
-            self._types = OrderedDict()
+        # name -> (aligned distance, shadow distance), the distances are immutable canonical nodes or '*'
+        self._types = types if types else OrderedDict()
+        # reverse dependencies: name -> frozenset of the variables whose distances mention it, and the position of
+        # each variable in _types to report the dependents in order, both are maintained incrementally by _set
+        self._dependents = {}
+        self._positions = {}
+        for name, distances in self._types.items():
+            self._index(name, (), distances)
+        # the dicts might be shared with the copies of this type system, in which case they are copied before
+        # the first write (copy-on-write), so copying the type system itself is O(1)
+        self._shared = False
 
     def __str__(self):
         # convert AST representation to code representation for better human-readability
         return '{{{}}}'.format(
             ', '.join('{}: [{}, {}]'.format(name,
-                                            aligned if aligned == '*' else _generator.visit(aligned),
-                                            shadow if shadow == '*' else _generator.visit(shadow))
+                                            aligned if aligned == '*' else _to_code(aligned),
+                                            shadow if shadow == '*' else _to_code(shadow))
                       for name, (aligned, shadow) in self._types.items()
                       )
         )
@@ -108,38 +525,79 @@ class TypeSystem:
 
     def __eq__(self, other):
         if isinstance(other, TypeSystem):
-            return self._types.__repr__() == other.__repr__()
+            # distances are canonical nodes, so comparing them by identity is sufficient
+            return self._types is other._types or self._types == other._types
         else:
             return False
 
     def __contains__(self, item):
         return self._types.__contains__(item)
 
+    def signature(self):
+        """ return a hashable signature of the distances, equal type systems have equal signatures."""
+        return tuple(self._types.items())
+
+    def _index(self, name, old_distances, new_distances):
+        if name not in self._positions:
+            self._positions[name] = len(self._positions)
+        old_mentions = frozenset().union(*map(_mentions, old_distances))
+        new_mentions = frozenset().union(*map(_mentions, new_distances))
+        # the sets are replaced instead of modified since they are shared with the copies of the dict
+        for mentioned in old_mentions - new_mentions:
+            self._dependents[mentioned] = self._dependents[mentioned] - {name}
+        for mentioned in new_mentions - old_mentions:
+            self._dependents[mentioned] = self._dependents.get(mentioned, frozenset()) | {name}
+
+    def _set(self, name, align, shadow):
+        if self._shared:
+            self._types = OrderedDict(self._types)
+            self._dependents = dict(self._dependents)
+            self._positions = dict(self._positions)
+            self._shared = False
+        old_distances = self._types.get(name, ())
+        self._types[name] = (align, shadow)
+        self._index(name, old_distances, (align, shadow))
+
     def copy(self):
-        return TypeSystem(copy.deepcopy(self._types))
+        types = TypeSystem()
+        types._types, types._dependents, types._positions = self._types, self._dependents, self._positions
+        types._shared = self._shared = True
+        return types
 
     def clear(self):
-        self._types.clear()
+        self._types = OrderedDict()
+        self._dependents = {}
+        self._positions = {}
+        self._shared = False
 
     def variables(self):
         for name in self._types.keys():
             yield name, self.get_distance(name)
 
+    def dependents(self, name):
+        """ return the variables whose distances might depend on the given variable, in the order of variables().
+        The candidates are found by the identifiers in the distances, in time proportional to their number.
+        :param name: The name of the variable.
+        :return: List of the names of the candidate variables.
+        """
+        return sorted(self._dependents.get(name, ()), key=self._positions.__getitem__)
+
     def apply(self, condition, is_true):
         simplifier = _DistanceSimplifier(condition, is_true)
-        for name in self._types.keys():
-            self._types[name] = \
-                [simplifier.simplify(distance) if distance != '*' else distance for distance in self._types[name]]
+        for name, (align, shadow) in tuple(self._types.items()):
+            new_align = simplifier.simplify(align) if align != '*' else align
+            new_shadow = simplifier.simplify(shadow) if shadow != '*' else shadow
+            if new_align is not align or new_shadow is not shadow:
+                self._set(name, new_align, new_shadow)
 
     def diff(self, other):
         assert isinstance(other, TypeSystem)
-        for name, *_ in other.variables():
+        for name, (other_aligned, other_shadow) in other._types.items():
             if name not in self._types:
                 yield (name, True)
                 yield (name, False)
             else:
                 aligned, shadow = self._types[name]
-                other_aligned, other_shadow = other.get_raw_distance(name)
                 if not is_node_equal(aligned, other_aligned):
                     yield (name, True)
                 if not is_node_equal(shadow, other_shadow):
@@ -147,16 +605,15 @@ class TypeSystem:
 
     def merge(self, other):
         assert isinstance(other, TypeSystem)
-        for name, *_ in other.variables():
+        for name, (other_align, other_shadow) in other._types.items():
             if name not in self._types:
-                self._types[name] = other.get_raw_distance(name)
+                self._set(name, other_align, other_shadow)
             else:
                 cur_align, cur_shadow = self._types[name]
-                other_align, other_shadow = other.get_raw_distance(name)
-                if not (cur_align == other_align == '*' or is_node_equal(cur_align, other_align)):
-                    self._types[name][0] = '*'
-                if not (cur_shadow == other_shadow == '*' or is_node_equal(cur_shadow, other_shadow)):
-                    self._types[name][1] = '*'
+                new_align = cur_align if is_node_equal(cur_align, other_align) else '*'
+                new_shadow = cur_shadow if is_node_equal(cur_shadow, other_shadow) else '*'
+                if new_align is not cur_align or new_shadow is not cur_shadow:
+                    self._set(name, new_align, new_shadow)
 
     def get_raw_distance(self, name):
         """ return the raw distance, in AST node representation.
@@ -170,32 +627,20 @@ class TypeSystem:
         :param name: The name of the variable.
         :return: (Aligned distance, Shadow distance) of the variable.
         """
-        return tuple('*' if distance == '*' else _generator.visit(distance) for distance in self._types[name])
+        return tuple('*' if distance == '*' else _to_code(distance) for distance in self._types[name])
 
     def update_distance(self, name, align, shadow):
         # try simplify
-        from sympy import simplify
-
-        align = str(align).replace('[', '__LEFTBRACE__').replace(']', '__RIGHTBRACE__')
-        shadow = str(shadow).replace('[', '__LEFTBRACE__').replace(']', '__RIGHTBRACE__')
-        try:
-            align = simplify(align)
-        except Exception:
-            pass
-        try:
-            shadow = simplify(shadow)
-        except Exception:
-            pass
-        align = str(align).replace('__LEFTBRACE__', '[').replace('__RIGHTBRACE__', ']')
-        shadow = str(shadow).replace('__LEFTBRACE__', '[').replace('__RIGHTBRACE__', ']')
+        align = simplify_expression(align)
+        shadow = simplify_expression(shadow)
         # convert to internal AST representation
-        align = convert_to_ast(align) if align != '*' else '*'
-        shadow = convert_to_ast(shadow) if shadow != '*' else '*'
+        align = _parse_interned(align) if align != '*' else '*'
+        shadow = _parse_interned(shadow) if shadow != '*' else '*'
         if name not in self._types:
-            self._types[name] = [align, shadow]
+            self._set(name, align, shadow)
         else:
             cur_aligned, cur_shadow = self._types[name]
-            if not is_node_equal(cur_aligned, align):
-                self._types[name][0] = align
-            if not is_node_equal(cur_shadow, shadow):
-                self._types[name][1] = shadow
+            if not (is_node_equal(cur_aligned, align) and is_node_equal(cur_shadow, shadow)):
+                self._set(name,
+                          cur_aligned if is_node_equal(cur_aligned, align) else align,
+                          cur_shadow if is_node_equal(cur_shadow, shadow) else shadow)
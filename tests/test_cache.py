@@ -0,0 +1,60 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from shadowdp.cache import DiskCache
+
+
+def test_disk_cache(tmpdir):
+    cache = DiskCache('test', max_size=1024, root=str(tmpdir))
+    key = DiskCache.key(b'source', 'revision', '')
+    assert key != DiskCache.key(b'sourcerevision', '')
+    assert cache.get(key) is None
+    cache.set(key, (True, 'MathSat', '1.234s'))
+    assert cache.get(key) == (True, 'MathSat', '1.234s')
+
+    # least recently used entries are evicted when the cache is full
+    old_time = time.time() - 100
+    os.utime(os.path.join(str(tmpdir), 'test', key), (old_time, old_time))
+    for index in range(10):
+        cache.set(DiskCache.key(index), b'0' * 200)
+    assert cache.get(key) is None
+    assert cache.get(DiskCache.key(9)) == b'0' * 200
+
+
+def _increment(root):
+    cache = DiskCache('test', root=root)
+    for _ in range(20):
+        cache.update(DiskCache.key('counter'), lambda count: count + 1, 0)
+
+
+def test_disk_cache_update(tmpdir):
+    # the updates of concurrent processes are all kept
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        for future in [executor.submit(_increment, str(tmpdir)) for _ in range(4)]:
+            future.result()
+    cache = DiskCache('test', max_size=0, root=str(tmpdir))
+    assert cache.get(DiskCache.key('counter')) == 80
+    # the lock file is never evicted
+    cache.set(DiskCache.key('other'), 0)
+    assert os.listdir(os.path.join(str(tmpdir), 'test')) == ['.lock']
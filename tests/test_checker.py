@@ -19,7 +19,8 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from shadowdp.checker import check
+import pytest
+from shadowdp.checker import check, parse_portfolio, DEFAULT_TIMEOUT, _obligations, _decompose, _jvm_environment
 
 
 def test_check():
@@ -41,4 +42,50 @@ def test_check():
     assert check('./cpachecker', './examples/transformed/gapsparsevector_rewrite.c',
                  '-setprop cpa.predicate.abstraction.initialPredicates='
                  './examples/transformed/gapsparsevector_predmap.txt')
+    assert check('./cpachecker', './examples/transformed/noisymax.c', decompose=True)
 
+
+def test_jvm_environment(tmpdir, monkeypatch):
+    monkeypatch.delenv('JAVA_VM_ARGUMENTS', raising=False)
+    archive, class_list = str(tmpdir.join('cpachecker.jsa')), str(tmpdir.join('cpachecker.classlist'))
+    assert _jvm_environment(archive) is None
+    # the first run records the loaded classes, the later ones map the archive dumped from them
+    assert _jvm_environment(archive, class_list)['JAVA_VM_ARGUMENTS'].endswith(
+        '-XX:DumpLoadedClassList={}'.format(class_list))
+    tmpdir.join('cpachecker.jsa').write('')
+    assert _jvm_environment(archive, class_list)['JAVA_VM_ARGUMENTS'].endswith(
+        '-Xshare:auto -XX:SharedArchiveFile={}'.format(archive))
+    monkeypatch.setenv('JAVA_VM_ARGUMENTS', '-Xmx1g')
+    assert _jvm_environment(vm_arguments='-Xshare:dump')['JAVA_VM_ARGUMENTS'] == \
+        '-Xmx1g -XX:+IgnoreUnrecognizedVMOptions -XX:+UseAppCDS -Xshare:dump'
+
+
+def test_decompose():
+    with open('./examples/transformed/noisymax.c') as f:
+        source = f.read()
+    obligations = _obligations(source)
+    assert [(obligation.function, obligation.line) for obligation in obligations] == \
+        [('noisymax', 30), ('noisymax', 38), ('noisymax', 51), ('noisymax', 65)]
+    assert obligations[-1].condition == '__SHADOWDP_v_epsilon <= epsilon'
+    for index, obligation in enumerate(obligations):
+        program = _decompose(source, obligations, index)
+        # only the assertion itself is left, the macro definition is untouched
+        assert [(other.line, other.condition) for other in _obligations(program)] == \
+            [(obligation.line, obligation.condition)]
+        assert program.count('#define __VERIFIER_assert(cond)') == 1
+        assert program.count('__VERIFIER_assume(') == source.count('__VERIFIER_assume(') + len(obligations) - 1
+
+
+def test_parse_portfolio():
+    portfolio = parse_portfolio()
+    assert portfolio.solvers == ('MathSat', 'Z3', 'SMTInterpol')
+    assert portfolio.timeouts == {name: DEFAULT_TIMEOUT for name in portfolio.solvers}
+    assert portfolio.max_concurrency == 3
+    portfolio = parse_portfolio('Z3, SMTInterpol', '60,Z3=120', 1)
+    assert portfolio.solvers == ('Z3', 'SMTInterpol')
+    assert portfolio.timeouts == {'Z3': 120, 'SMTInterpol': 60}
+    assert portfolio.max_concurrency == 1
+    for arguments in (('Foo', None, None), ('Z3,Z3', None, None), ('Z3', 'MathSat=10', None), (None, '-1', None),
+                      (None, None, 0)):
+        with pytest.raises(ValueError):
+            parse_portfolio(*arguments)
@@ -0,0 +1,52 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+from pycparser.c_parser import CParser
+from shadowdp.core import ShadowDPTransformer
+from shadowdp.transform import FUNCTION_MAP
+from shadowdp.generator import generate, generate_suite
+from shadowdp.batch import parse_manifest
+
+
+def test_generate():
+    for mechanism in ('sparsevector', 'noisymax', None):
+        for adjacency in ('ALL_DIFFER', 'ONE_DIFFER'):
+            program = generate(queries=2, samples=2, mechanism=mechanism, depth=2, loops=2, variables=1,
+                               statements=2, adjacency=adjacency)
+            assert program.verdict
+            # generated programs are valid ShadowDP programs
+            ShadowDPTransformer(function_map=FUNCTION_MAP, set_epsilon=program.epsilon) \
+                .visit(CParser().parse(program.source))
+
+    # the last mechanism gets half of the noise if not private
+    assert 'Lap(4.0 / epsilon, "ALIGNED; -(' in generate(queries=2, samples=1, mechanism='noisymax').source
+    program = generate(queries=2, samples=1, mechanism='noisymax', private=False)
+    assert not program.verdict
+    assert 'Lap(2.0 / epsilon, "ALIGNED; -(' in program.source
+
+
+def test_generate_suite(tmpdir):
+    programs = generate_suite(str(tmpdir), 4)
+    tasks = parse_manifest(os.path.join(str(tmpdir), 'manifest.txt'))
+    assert [program.verdict for program in programs] == [True, False, True, False]
+    assert [os.path.basename(task.file) for task in tasks] == [program.name + '.c' for program in programs]
+    assert all(os.path.exists(task.file) for task in tasks)
@@ -19,6 +19,8 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import subprocess
+import sys
 from shadowdp.__main__ import main
 
 
@@ -32,3 +34,10 @@ def test_main():
     assert main(['check', './examples/original/partialsum.c', '-e', '1']) == 0
     assert main(['check', './examples/original/smartsum.c', '-e', '1', '-g', '2']) == 0
 
+
+def test_startup():
+    # run in a fresh interpreter since the modules are already imported by the other tests
+    code = 'import sys; from shadowdp.__main__ import main; import shadowdp; shadowdp.check; ' \
+           'print(" ".join(sorted(set(sys.modules) & {"pycparser", "z3", "sympy", "asyncio"})))'
+    imported = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True).stdout.decode()
+    assert imported.split() == []
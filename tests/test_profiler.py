@@ -0,0 +1,67 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import tracemalloc
+from shadowdp import profiler
+
+
+def test_profiler():
+    @profiler.profiled('allocate')
+    def allocate():
+        return [0] * 100000
+
+    # nothing is recorded when profiling is off
+    allocate()
+    assert profiler.stop() is None
+
+    profiler.start()
+    with profiler.phase('outer'):
+        allocate()
+        allocate()
+    profiler.record_solver('Z3', 'verified', 1.5, profiler.peak_rss(os.getpid()))
+    profiler.count('hit')
+    profiler.count('hit')
+    profiler.record_loop('f:3', 2, 0.5)
+    profiler.record_loop('f:3', 3, 0.25)
+    report = profiler.stop()
+    assert report['phases']['allocate']['calls'] == 2
+    assert report['phases']['outer']['calls'] == 1
+    assert report['phases']['outer']['seconds'] >= report['phases']['allocate']['seconds']
+    assert report['phases']['allocate']['peak_python_bytes'] >= 100000 * 8
+    assert report['solvers']['Z3']['outcome'] == 'verified'
+    assert report['counters'] == {'hit': 2}
+    assert report['loops'] == {'f:3': {'runs': 2, 'iterations': 5, 'seconds': 0.75}}
+    assert not profiler.is_enabled()
+
+
+def test_profiler_tracing():
+    # the tracing started by others is kept
+    tracemalloc.start()
+    try:
+        profiler.start()
+        assert profiler.stop() is not None
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    profiler.start()
+    profiler.stop()
+    assert not tracemalloc.is_tracing()
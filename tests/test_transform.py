@@ -0,0 +1,280 @@
+# MIT License
+#
+# Copyright (c) 2018-2019 Yuxin (Ryan) Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import random
+import re
+from pycparser import c_ast, parse_file
+from pycparser.c_generator import CGenerator
+from shadowdp import profiler
+from shadowdp.cache import DiskCache
+from shadowdp.core import ShadowDPTransformer, _RewritePlan
+from shadowdp.typesystem import TypeSystem
+from shadowdp.generator import generate
+from shadowdp.optimizer import optimize
+from shadowdp.transform import transform, transform_source, transform_ast, parse_source, parse_path, HEADER, \
+    FUNCTION_MAP
+
+
+def _find(node, node_type):
+    """ return the nodes of node_type in the AST in pre-order."""
+    nodes = [node] if isinstance(node, node_type) else []
+    for _, child in node.children():
+        # the inserted declarations have empty lists as bit sizes
+        if isinstance(child, c_ast.Node):
+            nodes.extend(_find(child, node_type))
+    return nodes
+
+
+def _rename(code):
+    """ rename the parameters epsilon and q (with the distances of q) so that they differ from the other function."""
+    return re.sub(r'\b(__SHADOWDP_\w+_DISTANCE_)?q\b', r'\1queries', re.sub(r'\bepsilon\b', 'eps', code))
+
+
+def test_transform_multiple_functions(tmpdir):
+    # each function is transformed on its own, as if it were in a file by itself
+    sources = ('./examples/original/noisymax.c', './examples/original/sparsevector.c')
+    expected = []
+    for index, source in enumerate(sources):
+        out = str(tmpdir.join('{}_t.c'.format(index)))
+        assert transform(source, out)
+        with open(out) as f:
+            expected.append(f.read()[len(HEADER):])
+    expected[1] = _rename(expected[1])
+    combined = tmpdir.join('combined.c')
+    combined.write(open(sources[0]).read() + _rename(open(sources[1]).read()))
+    for jobs in (1, 2):
+        out = str(tmpdir.join('combined_t.c'))
+        assert transform(str(combined), out, jobs=jobs)
+        with open(out) as f:
+            assert f.read() == HEADER + ''.join(expected)
+    # the same transformer instance doesn't carry the state of a function over to the next one
+    ast = parse_file(str(combined))
+    ShadowDPTransformer(function_map=FUNCTION_MAP).visit(ast)
+    assert CGenerator().visit(ast) == ''.join(expected)
+
+
+def test_transform_source(tmpdir):
+    out = str(tmpdir.join('sparsevectorN_t.c'))
+    assert transform('./examples/original/sparsevectorN.c', out, epsilon='NN')
+    with open('./examples/original/sparsevectorN.c') as f:
+        source = f.read()
+    with open(out) as f:
+        expected = f.read()
+    assert transform_source(source, epsilon='NN') == expected
+    # the sources with preprocessor directives are preprocessed
+    assert transform_source('#define NOISE 2.0\n' + source.replace('Lap(2.0', 'Lap(NOISE'), epsilon='NN') == expected
+
+
+def test_parse_path(tmpdir):
+    source = tmpdir.join('noisymax.c')
+    # comments and directives need the preprocessor
+    for text in (open('./examples/original/noisymax.c').read(),
+                 '#define NOISE 2.0\n/* noisy max */\n' + open('./examples/original/noisymax.c').read()):
+        source.write(text)
+        expected = CGenerator().visit(parse_file(str(source), use_cpp=True, cpp_path='gcc', cpp_args=['-E']))
+        for is_cached in (False, True):
+            profiler.start()
+            ast = parse_path(str(source))
+            assert profiler.stop()['counters'].get('ast_cache_hit', 0) == is_cached
+            assert CGenerator().visit(ast) == expected
+            assert ast.ext[0].coord.file == str(source)
+        assert CGenerator().visit(parse_path(str(source), use_cache=False)) == expected
+
+
+def test_loop_memo(monkeypatch):
+    source = generate(loops=2, variables=2, statements=2, depth=2).source
+    profiler.start()
+    code = transform_source(source, use_cache=False)
+    assert profiler.stop()['counters']['loop_memo_hit'] > 0
+    # without the memo (every signature is new) each statement is analyzed in each iteration, with the same result
+    monkeypatch.setattr(TypeSystem, 'signature', lambda self: object())
+    profiler.start()
+    assert transform_source(source, use_cache=False) == code
+    assert 'loop_memo_hit' not in profiler.stop()['counters']
+
+
+def test_loop_statistics():
+    ast = parse_source(generate(loops=2).source, use_cache=False)
+    transformer = ShadowDPTransformer(function_map=FUNCTION_MAP)
+    profiler.start()
+    transformer.visit(ast)
+    loops = profiler.stop()['loops']
+    # the statistics are recorded when the fixed point is reached, i.e., the inner loop first
+    outer_line, inner_line = (node.coord.line for node in _find(ast, c_ast.While))
+    assert list(transformer.loop_statistics.keys()) == [('generated', inner_line), ('generated', outer_line)]
+    assert list(loops.keys()) == ['generated:{}'.format(inner_line), 'generated:{}'.format(outer_line)]
+    inner, outer = loops.values()
+    assert inner == transformer.loop_statistics[('generated', inner_line)]
+    # the inner loop runs once in each iteration of the outer loop, and once more for the transformation
+    assert outer['runs'] == 1 and inner['runs'] == outer['iterations'] + 1
+    assert all(loop['iterations'] >= loop['runs'] and loop['seconds'] > 0 for loop in loops.values())
+
+
+def test_optimize():
+    source = open('./examples/original/noisymax.c').read()
+    code, optimized = (transform_source(source, use_cache=False, optimize=is_optimized)
+                       for is_optimized in (False, True))
+    # the assertions and the nondeterministic values are untouched
+    for call in ('__VERIFIER_assert', '__VERIFIER_nondet_float'):
+        assert re.findall(r'{}\(.*'.format(call), code) == re.findall(r'{}\(.*'.format(call), optimized)
+    assert optimized.count(';') < code.count(';')
+    # noisy max doesn't use the shadow distance of max
+    assert '__SHADOWDP_SHADOW_DISTANCE_max' in code and '__SHADOWDP_SHADOW_DISTANCE_max' not in optimized
+    ast = transform_ast(parse_source(source, use_cache=False), use_cache=False)
+    statistics = optimize(ast, FUNCTION_MAP)
+    assert all(statistics[name] > 0 for name in ('hoisted_assumes', 'redundant_assumes', 'dead_stores'))
+    # the optimized program is a fixed point
+    assert all(count == 0 for count in optimize(ast, FUNCTION_MAP).values())
+    assert HEADER + CGenerator().visit(ast) == optimized
+
+    # y = (y + 0) * 1 is folded into a self-assignment, and the assume is already in effect in the branch
+    ast = parse_source('int f(int x, int y) { x = x; y = (y + 0) * 1; __VERIFIER_assume(y > 0); if (x > 0) { '
+                       '__VERIFIER_assume(y > 0); x = 1; } else { x = 2; } return x; }', use_cache=False)
+    optimize(ast, FUNCTION_MAP)
+    assert CGenerator().visit(ast) == CGenerator().visit(parse_source(
+        'int f(int x, int y) { __VERIFIER_assume(y > 0); if (x > 0) { x = 1; } else { x = 2; } return x; }',
+        use_cache=False))
+
+
+def test_query_cache(tmpdir):
+    # the results of the z3 queries are reused by other transformers (e.g., in other processes)
+    cache = DiskCache('z3', root=str(tmpdir))
+    outputs, reports = [], []
+    for _ in range(2):
+        ast = parse_file('./examples/original/sparsevector.c')
+        profiler.start()
+        ShadowDPTransformer(function_map=FUNCTION_MAP, query_cache=cache).visit(ast)
+        reports.append(profiler.stop())
+        outputs.append(CGenerator().visit(ast))
+    assert len(tmpdir.join('z3').listdir()) == reports[0]['phases']['z3']['calls'] > 0
+    assert 'z3' not in reports[1]['phases']
+    assert reports[1]['counters']['z3_cache_hit'] == \
+        reports[0]['phases']['z3']['calls'] + reports[0]['counters'].get('z3_cache_hit', 0)
+    assert outputs[0] == outputs[1]
+    ast = parse_file('./examples/original/sparsevector.c')
+    ShadowDPTransformer(function_map=FUNCTION_MAP).visit(ast)
+    assert CGenerator().visit(ast) == outputs[0]
+
+
+def test_z3_session(tmpdir, monkeypatch):
+    # the queries checked in the push / pop scopes of the solver session have the same results as in a fresh solver
+    # with the precondition, and each function (here with different adjacencies) has its own session
+    import z3
+    source = tmpdir.join('combined.c')
+    source.write(open('./examples/original/noisymax.c').read() +
+                 _rename(generate(name='one_differ', adjacency='ONE_DIFFER', variables=1, statements=1).source))
+    checks = []
+    z3_check = ShadowDPTransformer._z3_check
+
+    def checked(self, *constraints):
+        result = z3_check(self, *constraints)
+        precondition = self._z3_precondition()[0]
+        solver = z3.Solver()
+        solver.add(precondition, *constraints)
+        assert solver.check() == result
+        # the scope of the query is popped, only the precondition of current function is left
+        assertions = self._z3_solver.assertions()
+        assert len(assertions) == 1 and assertions[0].eq(precondition)
+        checks.append((self._function_name, assertions[0].sexpr(), result))
+        return result
+
+    monkeypatch.setattr(ShadowDPTransformer, '_z3_check', checked)
+    transformer = ShadowDPTransformer(function_map=FUNCTION_MAP)
+    transformer.visit(parse_file(str(source)))
+    assert [name for name, *_ in checks] == sorted(name for name, *_ in checks)
+    sessions = {name: precondition for name, precondition, _ in checks}
+    assert sorted(sessions.keys()) == ['noisymax', 'one_differ'] and len(set(sessions.values())) == 2
+
+
+def test_z3_session_fallback(tmpdir, monkeypatch):
+    # the session answers the satisfiable and unsatisfiable queries as a fresh solver with the precondition does, also
+    # when the incremental solver gives up on them (here forced by a tiny timeout) and a fresh solver checks them again
+    import z3
+    from shadowdp import core
+    for timeout in (core._Z3_SESSION_TIMEOUT, 1):
+        monkeypatch.setattr(core, '_Z3_SESSION_TIMEOUT', timeout)
+        for adjacency in ('ALL_DIFFER', 'ONE_DIFFER'):
+            source = tmpdir.join('{}.c'.format(adjacency))
+            source.write(generate(name='f', adjacency=adjacency, variables=1, statements=1).source)
+            transformer = ShadowDPTransformer(function_map=FUNCTION_MAP)
+            transformer.visit(parse_file(str(source)))
+            _, replaces = transformer._z3_session()
+            distance = next(array for name, array in replaces.items() if 'ALIGNED' in name)
+            eta = z3.Real('eta')
+            results = []
+            profiler.start()
+            # queries a fresh solver decides, either solver gives up on some other (satisfiable) ones under ONE_DIFFER
+            for constraints in ((distance[0] > 1, ), (eta > 1, ), (eta == 2, ),
+                                (eta + distance[0] == eta + distance[1], distance[0] != distance[1])):
+                solver = z3.Solver()
+                solver.set('timeout', core._Z3_TIMEOUT)
+                solver.add(transformer._z3_precondition()[0], *constraints)
+                expected = solver.check()
+                assert transformer._z3_check(*constraints) == expected
+                results.append(str(expected))
+            report = profiler.stop()
+            assert results == ['unsat', 'sat', 'sat', 'unsat']
+            if timeout == 1:
+                assert report['counters'].get('z3_session_fallback', 0) > 0
+
+
+def test_rewrite_plan():
+    # the plan inserts the statements at the same positions as inserting them into the block items right away
+    def assume():
+        return c_ast.FuncCall(c_ast.ID('assume'), None)
+
+    def statement():
+        return c_ast.FuncCall(c_ast.ID('assert'), None)
+
+    def start_index(items):
+        for index, item in enumerate(items):
+            if item.name.name != 'assume':
+                return index
+        return 0
+
+    generator = random.Random(0)
+    for _ in range(200):
+        items = [generator.choice((assume, statement))() for _ in range(generator.randrange(4))]
+        block, plan = c_ast.Compound(list(items)), _RewritePlan(c_ast.Compound(list(items)), 'assume')
+        for _ in range(generator.randrange(8)):
+            operation = generator.choice(('front', 'before', 'after', 'extend'))
+            # only the statements inserted at the front might be assume function calls
+            statements = [(generator.choice((assume, statement)) if operation == 'front' else statement)()
+                          for _ in range(generator.randrange(3))]
+            anchors = [item for item in items if item.name.name != 'assume']
+            if operation == 'front':
+                index = start_index(block.block_items)
+                block.block_items[index:index] = statements
+                plan.insert_front(statements)
+            elif operation == 'extend':
+                block.block_items.extend(statements)
+                plan.extend(statements)
+            elif anchors and statements:
+                node = generator.choice(anchors)
+                index = block.block_items.index(node)
+                if operation == 'before':
+                    block.block_items[index:index] = statements
+                    plan.insert_before(node, statements)
+                else:
+                    block.block_items.insert(index + 1, statements[0])
+                    plan.insert_after(node, statements[0])
+        plan.apply()
+        assert list(map(id, plan._block.block_items)) == list(map(id, block.block_items))
@@ -19,7 +19,9 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from shadowdp.typesystem import TypeSystem, convert_to_ast
+from pycparser.c_parser import CParser
+from shadowdp.typesystem import TypeSystem, convert_to_ast, simplify_expression, simplify_cache_info, \
+    simplify_stats, clear_caches, intern_node, is_node_equal, _sympy_simplify
 
 
 def test_type_system():
@@ -34,3 +36,79 @@ def test_type_system():
     assert copy.get_distance('a') == ('c', '*')
     types.apply(convert_to_ast('b'), False)
     assert types.get_distance('a') == ('d', '*')
+
+
+def test_dependents():
+    types = TypeSystem()
+    types.update_distance('x', '0', '0')
+    types.update_distance('a', 'x + 1', '*')
+    types.update_distance('b', '2', 'q[x]')
+    types.update_distance('c', 'y', '0')
+    assert types.dependents('x') == ['a', 'b']
+    assert types.dependents('q') == ['b']
+    assert types.dependents('z') == []
+    # the index is copied on write together with the distances
+    copy = types.copy()
+    copy.update_distance('a', '*', '*')
+    copy.update_distance('c', 'x', '0')
+    assert copy.dependents('x') == ['b', 'c']
+    assert types.dependents('x') == ['a', 'b']
+    # merging promotes the differing distances of c to *
+    copy.merge(types)
+    assert copy.dependents('x') == ['b']
+
+
+def test_simplify_expression():
+    assert simplify_expression('q[i] + 1 - 1') == 'q[i]'
+    assert simplify_expression('*') == '*'
+    assert simplify_expression('b ? c : d') == 'b ? c : d'
+    hits = simplify_cache_info().hits
+    assert simplify_expression('q[i] + 1 - 1') == 'q[i]'
+    assert simplify_cache_info().hits == hits + 1
+
+
+def test_simplify_linear():
+    # the linear expressions of distance variables are normalized without sympy, to the same results
+    expressions = ('(__SHADOWDP_ALIGNED_DISTANCE_q[i]) + 2', '1 - __SHADOWDP_ALIGNED_DISTANCE_x',
+                   '__SHADOWDP_SHADOW_DISTANCE_sum + (__SHADOWDP_SHADOW_DISTANCE_q[i]) - 0',
+                   '2 * (__SHADOWDP_ALIGNED_DISTANCE_x - 3) + -__SHADOWDP_ALIGNED_DISTANCE_b + 4',
+                   '__SHADOWDP_ALIGNED_DISTANCE_x + (-__SHADOWDP_ALIGNED_DISTANCE_x)')
+    # the counters only count the expressions not in the cache
+    clear_caches()
+    for expression in expressions:
+        before = simplify_stats()
+        simplified = simplify_expression(expression)
+        assert simplify_stats()['linear'] == before['linear'] + 1
+        assert simplify_stats()['sympy'] == before['sympy']
+        escaped = expression.replace('[', '__LEFTBRACE__').replace(']', '__RIGHTBRACE__')
+        assert simplified == _sympy_simplify(escaped).replace('__LEFTBRACE__', '[').replace('__RIGHTBRACE__', ']')
+    # the non-linear ones go to sympy
+    before = simplify_stats()
+    assert simplify_expression('(Abs(2) * (1/(2 / epsilon)))') == 'epsilon'
+    assert simplify_stats()['sympy'] == before['sympy'] + 1
+
+
+def test_convert_to_ast():
+    parser = CParser()
+    for expression in ('(q[i] + eta > bq || i == 0) ? 2 : 0', 'Abs(q[i]) / (2 * epsilon)', '-x * -1.5 - y % 2',
+                       'a ? b : c ? d : e', '!(a && b) || ~c', 'sizeof(a)', 'a++'):
+        expected = parser.parse('int placeholder(){{{};}}'.format(expression)).ext[0].body.block_items[0]
+        assert repr(convert_to_ast(expression)) == repr(expected)
+    # each call returns a fresh node
+    assert convert_to_ast('a + b') is not convert_to_ast('a + b')
+
+
+def test_intern_node():
+    node_1, node_2 = convert_to_ast('q[i] + eta > bq ? 2 : 0'), convert_to_ast('q[i] + eta > bq ? 2 : 0')
+    assert intern_node(node_1) is intern_node(node_2)
+    assert intern_node(node_1) is not node_1
+    assert intern_node(node_1).cond is intern_node(convert_to_ast('q[i] + eta > bq'))
+    assert is_node_equal(node_1, node_2) and not is_node_equal(node_1, convert_to_ast('q[i] + eta > bq ? 2 : 1'))
+    assert not is_node_equal(node_1, '*') and is_node_equal('*', '*')
+    types = TypeSystem()
+    types.update_distance('a', 'b ? c : d', '*')
+    copy = types.copy()
+    assert copy == types
+    copy.update_distance('a', 'b ? c : e', '*')
+    assert copy != types
+    assert types.get_distance('a') == ('(b) ? (c) : (d)', '*')